@@ -0,0 +1,505 @@
+import copy
+import numpy as np
+import pandas as pd
+
+# axes of the crime cube, the rolled up cube keeps only the first four
+CUBE_DIMENSIONS = ["YEAR", "MONTH", "DISTRICT", "OFFENSE_CODE_GROUP", "DAY_OF_WEEK", "HOUR"]
+ROLLUP_DIMENSIONS = CUBE_DIMENSIONS[:4]
+# axes of the date range counts, the day of the week of a day follows from its date
+DATE_DIMENSIONS = ["DISTRICT", "OFFENSE_CODE_GROUP", "DAY_OF_WEEK", "HOUR"]
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+## FUNCTIONS
+def build_cube(df, cumulative = True):
+    """
+    Aggregates the crime data into a cube of counts, one axis per dimension in
+    CUBE_DIMENSIONS. Every dimension is stored as categorical integer codes so
+    the cube size depends on the number of distinct values and not on the number
+    of crime records.
+
+    Parameters
+    ----------
+    df : Pandas Data Frame
+        Dataframe of crime data
+    cumulative : boolean
+        whether to sum the crimes per day up over time for date ranges, the
+        chunks of a store being built leave it to the store
+
+    Returns
+    -------
+    CrimeCube
+        the crime counts for every combination of the dimensions
+    """
+    codes = []
+    categories = {}
+    for dim in CUBE_DIMENSIONS:
+        if df[dim].dtype.name == 'category':
+            # categorical columns already hold integer codes in a fixed order
+            dim_codes, labels = df[dim].cat.codes.to_numpy(), pd.Index(df[dim].cat.categories)
+        else:
+            dim_codes, labels = pd.factorize(df[dim], sort = True)
+        if (dim_codes < 0).any():
+            # missing values get their own slot at the end of the axis
+            dim_codes = np.where(dim_codes < 0, len(labels), dim_codes)
+            labels = labels.append(pd.Index([np.nan]))
+        codes.append(dim_codes)
+        categories[dim] = labels
+    shape = tuple(len(categories[dim]) for dim in CUBE_DIMENSIONS)
+    flat = np.ravel_multi_index(codes, shape)
+    counts = np.bincount(flat, minlength = int(np.prod(shape))).reshape(shape)
+    daily, first_day, day_totals = None, None, None
+    if 'DATE' in df.columns and len(df) > 0:
+        # crimes per day, neighbourhood and crime for the weekly and daily trends
+        days = df['DATE'].to_numpy().astype(np.int64)
+        first_day = int(days.min())
+        daily_shape = (int(days.max()) - first_day + 1,) + shape[2:4]
+        flat = np.ravel_multi_index((days - first_day, codes[2], codes[3]), daily_shape)
+        daily = np.bincount(flat, minlength = int(np.prod(daily_shape))).reshape(daily_shape).astype(np.uint32)
+        if cumulative:
+            # crimes per day, neighbourhood, crime and hour summed up over time for the date ranges
+            day_counts = day_count_array(len(daily), shape[2:4] + shape[5:])
+            add_day_counts(day_counts, days - first_day, codes[2], codes[3], codes[5])
+            day_totals = cumulate_days(day_counts, cumulative_dtype(counts))
+    return CrimeCube(counts.astype(np.uint32), categories, daily = daily, first_day = first_day,
+                     cumulative = day_totals)
+
+def day_count_array(days, shape):
+    """
+    Returns zero crimes per day, neighbourhood, crime and hour for days days,
+    rounded up to whole weeks so cumulate_days() sums them up without a copy.
+    No hour of a day has 65536 crimes of one kind in one neighbourhood.
+    """
+    return np.zeros((-(-days // 7) * 7,) + tuple(shape), dtype = np.uint16)
+
+def axis_codes(series, labels):
+    """
+    Returns the positions of the values of a column on a cube axis, missing
+    values on the missing slot at the end of the axis
+    """
+    if series.dtype.name == 'category':
+        positions = labels.get_indexer(series.cat.categories)
+        # the -1 code of missing values takes the last entry
+        positions = np.append(positions, len(labels) - 1)
+        return positions[series.cat.codes.to_numpy()]
+    return labels.get_indexer(series)
+
+def add_day_counts(day_counts, days, districts, crimes, hours):
+    """
+    Adds crimes to the crimes per day, neighbourhood, crime and hour
+
+    Parameters
+    ----------
+    day_counts : numpy array
+        crimes per day, neighbourhood, crime and hour from day_count_array()
+    days : numpy array
+        day of every crime counted from the first day of day_counts
+    districts, crimes, hours : numpy array
+        position of every crime on the DISTRICT, OFFENSE_CODE_GROUP and HOUR axes
+    """
+    cells, cell_counts = np.unique(np.ravel_multi_index((days, districts, crimes, hours), day_counts.shape),
+                                   return_counts = True)
+    # every cell is added once so the counts can be added in place
+    flat = day_counts.reshape(-1)
+    flat[cells] += cell_counts.astype(day_counts.dtype)
+
+def cumulative_dtype(counts):
+    """
+    Returns the narrowest unsigned type of the cumulative counts of a cube.
+    Sums over time may wrap around, the difference of two of them is still
+    exact as long as no neighbourhood, crime and hour has more crimes than
+    the type holds.
+    """
+    most = counts.sum(axis = (0, 1, 4), dtype = np.int64).max(initial = 0)
+    return np.uint16 if most < 2**16 else np.uint32
+
+def cumulate_days(day_counts, dtype):
+    """
+    Sums crimes per day up over time in steps of a week
+
+    Parameters
+    ----------
+    day_counts : numpy array
+        crimes per day, neighbourhood, crime and hour, whole weeks of days are
+        summed up without a copy
+    dtype : numpy type
+        type of the sums from cumulative_dtype()
+
+    Returns
+    -------
+    numpy array
+        crimes per (week, day of the week, neighbourhood, crime, hour) where
+        [w, r] holds the crimes of the days r, r + 7, ... before day 7w + r,
+        so the crimes of the same weekday between two weeks are the difference
+        of two entries
+    """
+    days = len(day_counts)
+    weeks = -(-days // 7)
+    if days != weeks * 7:
+        padded = np.zeros((weeks * 7,) + day_counts.shape[1:], dtype = day_counts.dtype)
+        padded[:days] = day_counts
+        day_counts = padded
+    cumulative = np.zeros((weeks + 1, 7) + day_counts.shape[1:], dtype = dtype)
+    np.cumsum(day_counts.reshape((weeks, 7) + day_counts.shape[1:]), axis = 0, dtype = dtype,
+              out = cumulative[1:])
+    return cumulative
+
+def add_cumulative_days(day_counts, cumulative, days, start = 0, positions = None):
+    """
+    Adds the crimes per day summed up by cumulate_days() to the crimes per
+    day, neighbourhood, crime and hour, a week at a time so no other array of
+    that size is needed
+
+    Parameters
+    ----------
+    day_counts : numpy array
+        crimes per day, neighbourhood, crime and hour from day_count_array()
+    cumulative : numpy array
+        cumulative counts of a cube
+    days : int
+        number of days of the cube
+    start : int
+        position of the first day of the cube in day_counts
+    positions : list
+        positions of the DISTRICT, OFFENSE_CODE_GROUP and HOUR axes of the cube
+        in day_counts, None when they are the same
+    """
+    for week in range(-(-days // 7)):
+        first, last = week * 7, min(week * 7 + 7, days)
+        # differences of wrapped around sums are exact in unsigned arithmetic
+        week_counts = (cumulative[week + 1] - cumulative[week])[:last - first].astype(day_counts.dtype)
+        if positions is None:
+            day_counts[start + first:start + last] += week_counts
+        else:
+            day_counts[np.ix_(np.arange(start + first, start + last), *positions)] += week_counts
+
+def merge_cubes(cube, added, cumulative = True):
+    """
+    Adds the counts of a cube built from new crime records to a cube, both
+    unfiltered
+
+    Parameters
+    ----------
+    cube : CrimeCube
+        counts of the stored crime records
+    added : CrimeCube
+        counts of the new crime records
+    cumulative : boolean
+        whether to add up the cumulative counts, a store built a chunk at a
+        time sums the crimes per day up once at the end instead
+
+    Returns
+    -------
+    CrimeCube
+        the counts of all the records, None when the new records have values
+        that are not on the axes of cube so it has to be rebuilt
+    """
+    positions = [cube.categories[dim].get_indexer(added.categories[dim]) for dim in CUBE_DIMENSIONS]
+    if any((dim_positions < 0).any() for dim_positions in positions):
+        return None
+    if (cube.daily is None) != (added.daily is None):
+        return None
+    if cumulative and (cube.cumulative is None) != (added.cumulative is None):
+        return None
+    counts = np.array(cube.counts)
+    # positions on every axis are unique so the counts can be added in place
+    counts[np.ix_(*positions)] += added.counts
+    daily, first_day = None, None
+    if cube.daily is not None:
+        first_day = min(cube.first_day, added.first_day)
+        days = max(cube.first_day + len(cube.daily), added.first_day + len(added.daily)) - first_day
+        daily = np.zeros((days,) + cube.daily.shape[1:], dtype = np.uint32)
+        start = cube.first_day - first_day
+        daily[start:start + len(cube.daily)] = cube.daily
+        start = added.first_day - first_day
+        day_positions = np.arange(start, start + len(added.daily))
+        daily[np.ix_(day_positions, positions[2], positions[3])] += added.daily
+    day_totals = None
+    if cumulative and cube.cumulative is not None:
+        day_counts = day_count_array(len(daily), cube.cumulative.shape[2:])
+        add_cumulative_days(day_counts, cube.cumulative, len(cube.daily), start = cube.first_day - first_day)
+        add_cumulative_days(day_counts, added.cumulative, len(added.daily), start = added.first_day - first_day,
+                            positions = [positions[2], positions[3], positions[5]])
+        day_totals = cumulate_days(day_counts, cumulative_dtype(counts))
+    return CrimeCube(counts, cube.categories, daily = daily, first_day = first_day, cumulative = day_totals)
+
+def select_positions(labels, value, is_range = False):
+    """
+    Finds the positions on a cube axis matching a chart_filter style value
+
+    Parameters
+    ----------
+    labels : Pandas Index
+        the labels of the cube axis
+    value : int, string or list
+        the value or values to keep, a list of two values is a range when is_range is True
+    is_range : boolean
+        whether a list value gives the first and last value of a range
+
+    Returns
+    -------
+    numpy array
+        the positions on the axis to keep
+    """
+    if type(value) == list:
+        if is_range:
+            value = list(range(value[0], value[1]+1))
+    else:
+        value = [value]
+    return np.flatnonzero(labels.isin(value))
+
+class CrimeCube:
+    """
+    Crime counts aggregated over CUBE_DIMENSIONS along with a selection of
+    positions on each axis. Filtering only narrows the selection, the counts
+    are summed when they are needed by a chart. The cube optionally holds the
+    crimes per day, neighbourhood and crime for the weekly and daily trends,
+    the days counted from first_day days since 1970-01-01, and the cumulative
+    crimes per day, neighbourhood, crime and hour that count any date range
+    from two entries per cell.
+    """
+    def __init__(self, counts, categories, rollup = None, selection = None, daily = None, first_day = None,
+                 cumulative = None):
+        self.counts = counts
+        self.categories = categories
+        if rollup is None:
+            rollup = counts.sum(axis = (4, 5), dtype = np.uint32)
+        self.rollup = rollup
+        if selection is None:
+            selection = {}
+        self.selection = selection
+        self.daily = daily
+        self.first_day = first_day
+        self.cumulative = cumulative
+        # crimes per year and month along with the first day of each month
+        self.monthly = rollup.sum(axis = (2, 3), dtype = np.int64)
+        years, months = np.meshgrid(categories["YEAR"], categories["MONTH"], indexing = "ij")
+        self.month_dates = pd.to_datetime({"year": years.ravel(), "month": months.ravel(), "day": 1}
+                                          ).to_numpy().reshape(years.shape)
+
+    def filter(self, year = None, month = None, neighbourhood = None, crime = None, date = None):
+        """
+        Filters the cube the same way chart_filter filters the crime data
+
+        Parameters
+        ----------
+        year : int or list
+            year or range of years to keep
+        month : int or list
+            month or range of months to keep
+        neighbourhood : string or list
+            neighbourhood or neighbourhoods to keep
+        crime : string or list
+            crime or crimes to keep
+        date : int or list
+            day or range of days to keep, in days since 1970-01-01
+
+        Returns
+        -------
+        CrimeCube
+            a cube sharing the counts with a narrower selection
+        """
+        selection = dict(self.selection)
+        filters = [("YEAR", year, True),
+                   ("MONTH", month, True),
+                   ("DISTRICT", neighbourhood, False),
+                   ("OFFENSE_CODE_GROUP", crime, False)]
+        for dim, value, is_range in filters:
+            if value is None or (type(value) == list and value == [] and not is_range):
+                continue
+            positions = select_positions(self.categories[dim], value, is_range = is_range)
+            if dim in selection:
+                positions = np.intersect1d(selection[dim], positions)
+            selection[dim] = positions
+        if date is not None:
+            if self.cumulative is None:
+                raise ValueError("Date ranges need the crime dates, rebuild the cube from data with a DATE column")
+            first, last = date if type(date) == list else [date, date]
+            if "DATE" in selection:
+                first, last = max(first, selection["DATE"][0]), min(last, selection["DATE"][1])
+            selection["DATE"] = (first, last)
+        cube = copy.copy(self)
+        cube.selection = selection
+        return cube
+
+    def total(self):
+        """
+        Returns the number of crimes in the selection
+        """
+        if "DATE" in self.selection:
+            counts = self.date_counts()
+            for axis, dim in enumerate(DATE_DIMENSIONS[:2]):
+                if dim in self.selection:
+                    counts = counts.take(self.selection[dim], axis = axis)
+            return int(counts.sum(dtype = np.int64))
+        counts = self.rollup
+        for axis, dim in enumerate(ROLLUP_DIMENSIONS):
+            if dim in self.selection:
+                counts = counts.take(self.selection[dim], axis = axis)
+        return int(counts.sum(dtype = np.int64))
+
+    def day_mask(self):
+        """
+        Returns whether each day of the daily counts is in the selected years,
+        months and date range
+        """
+        days = np.arange(self.first_day, self.first_day + len(self.daily))
+        dates = pd.to_datetime(days, unit = "D")
+        keep = np.ones(len(days), dtype = bool)
+        if "YEAR" in self.selection:
+            keep &= dates.year.isin(self.categories["YEAR"][self.selection["YEAR"]])
+        if "MONTH" in self.selection:
+            keep &= dates.month.isin(self.categories["MONTH"][self.selection["MONTH"]])
+        if "DATE" in self.selection:
+            first, last = self.selection["DATE"]
+            keep &= (days >= first) & (days <= last)
+        return keep
+
+    def date_counts(self):
+        """
+        Counts the crimes of the selected days from the cumulative counts. Every
+        run of consecutive days costs two entries per cell and day of the week,
+        however many days or crime records it spans.
+
+        Returns
+        -------
+        numpy array
+            crimes per DATE_DIMENSIONS over every neighbourhood and crime
+        """
+        cumulative = self.cumulative
+        keep = np.concatenate([[False], self.day_mask(), [False]])
+        # the first and one past the last day of every run of selected days
+        edges = np.flatnonzero(keep[1:] != keep[:-1])
+        starts, stops = edges[::2], edges[1::2]
+        weekday_counts = np.zeros((7,) + cumulative.shape[2:], dtype = np.int64)
+        for weekday in range(7):
+            # the weeks of the first and one past the last day of each run on this day of the week
+            first_weeks = -((weekday - starts) // 7)
+            last_weeks = -((weekday - stops) // 7)
+            for first_week, last_week in zip(first_weeks, last_weeks):
+                if last_week > first_week:
+                    weekday_counts[weekday] += cumulative[last_week, weekday] - cumulative[first_week, weekday]
+        labels = self.categories["DAY_OF_WEEK"]
+        names = [DAYS_OF_WEEK[(self.first_day + 3 + weekday) % 7] for weekday in range(7)]
+        counts = np.zeros((len(labels),) + weekday_counts.shape[1:], dtype = np.int64)
+        positions = labels.get_indexer(names)
+        found = positions >= 0
+        counts[positions[found]] = weekday_counts[found]
+        # neighbourhood and crime first as in the cube
+        return counts.transpose(1, 2, 0, 3)
+
+    def count(self, by):
+        """
+        Sums the selected counts by the given dimensions, like a groupby size
+        on the filtered crime data
+
+        Parameters
+        ----------
+        by : string or list
+            dimension or dimensions to group the counts by
+
+        Returns
+        -------
+        Pandas Series
+            the crime count named n for every non empty group
+        """
+        if type(by) != list:
+            by = [by]
+        if "DATE" in self.selection:
+            if any(dim not in DATE_DIMENSIONS for dim in by):
+                raise ValueError("Crimes in a date range can only be counted by %s" % ", ".join(DATE_DIMENSIONS))
+            counts, dims = self.date_counts(), DATE_DIMENSIONS
+        elif all(dim in ROLLUP_DIMENSIONS for dim in by):
+            counts, dims = self.rollup, ROLLUP_DIMENSIONS
+        else:
+            counts, dims = self.counts, CUBE_DIMENSIONS
+        positions = {}
+        for dim in dims:
+            labels = self.categories[dim]
+            dim_positions = self.selection.get(dim)
+            if dim in by and labels.hasnans:
+                # groupby leaves out missing keys
+                if dim_positions is None:
+                    dim_positions = np.arange(len(labels))
+                dim_positions = dim_positions[labels[dim_positions].notna()]
+            if dim_positions is not None and len(dim_positions) < len(labels):
+                positions[dim] = dim_positions
+        # take the most selective axes first so later copies are small
+        for dim in sorted(positions, key = lambda dim: len(positions[dim]) / len(self.categories[dim])):
+            counts = counts.take(positions[dim], axis = dims.index(dim))
+        drop = tuple(axis for axis, dim in enumerate(dims) if dim not in by)
+        counts = counts.sum(axis = drop, dtype = np.int64)
+        kept = [dim for dim in dims if dim in by]
+        levels = [self.categories[dim][positions[dim]] if dim in positions else self.categories[dim]
+                  for dim in kept]
+        if len(kept) == 1:
+            index = pd.Index(levels[0], name = kept[0])
+        else:
+            index = pd.MultiIndex.from_product(levels, names = kept)
+        counts = pd.Series(counts.ravel(), index = index, name = "n")
+        counts = counts[counts > 0]
+        if kept != by:
+            counts = counts.reorder_levels(by)
+        return counts.sort_index()
+
+    def trend(self, granularity = "month"):
+        """
+        Counts the selected crimes over time. Monthly counts are sliced from the
+        crimes per year and month, so they cost the number of months whatever
+        the number of crime records.
+
+        Parameters
+        ----------
+        granularity : string
+            "month", "week" or "day", the last two need the daily counts
+
+        Returns
+        -------
+        Pandas Data Frame
+            the date of every non empty period and its count n of crimes with
+            an OFFENSE_CODE_GROUP, the YEAR and MONTH of monthly periods
+        """
+        selection = dict(self.selection)
+        crimes = self.categories["OFFENSE_CODE_GROUP"]
+        if "OFFENSE_CODE_GROUP" not in selection and crimes.hasnans:
+            # only crimes with an OFFENSE_CODE_GROUP are counted, as in the trend of the crime records
+            selection["OFFENSE_CODE_GROUP"] = np.flatnonzero(crimes.notna())
+        filtered = [dim for dim in ["DISTRICT", "OFFENSE_CODE_GROUP"] if dim in selection]
+        years = self.selection.get("YEAR", np.arange(len(self.categories["YEAR"])))
+        months = self.selection.get("MONTH", np.arange(len(self.categories["MONTH"])))
+        if granularity == "month" and "DATE" not in self.selection:
+            if filtered:
+                counts = self.rollup.take(years, axis = 0).take(months, axis = 1)
+                for dim in filtered:
+                    counts = counts.take(selection[dim], axis = ROLLUP_DIMENSIONS.index(dim))
+                counts = counts.sum(axis = (2, 3), dtype = np.int64)
+            else:
+                counts = self.monthly.take(years, axis = 0).take(months, axis = 1)
+            year_labels = self.categories["YEAR"][years]
+            month_labels = self.categories["MONTH"][months]
+            trend = pd.DataFrame({"YEAR": np.repeat(year_labels, len(month_labels)),
+                                  "MONTH": np.tile(month_labels, len(year_labels)),
+                                  "date": self.month_dates[np.ix_(years, months)].ravel(),
+                                  "n": counts.ravel()})
+            return trend[trend["n"] > 0].reset_index(drop = True)
+        if self.daily is None:
+            raise ValueError("%s trends need the crime dates, rebuild the cube from data with a DATE column"
+                             % granularity)
+        counts = self.daily
+        for dim in filtered:
+            counts = counts.take(selection[dim], axis = ROLLUP_DIMENSIONS.index(dim) - 1)
+        counts = counts.sum(axis = (1, 2), dtype = np.int64)
+        dates = pd.to_datetime(np.arange(self.first_day, self.first_day + len(counts)), unit = "D")
+        keep = self.day_mask()
+        trend = pd.DataFrame({"date": dates[keep], "n": counts[keep]})
+        if granularity == "month":
+            # the months of a date range are summed from its days
+            trend = trend.groupby([trend["date"].dt.year.rename("YEAR"), trend["date"].dt.month.rename("MONTH")]
+                                  )["n"].sum().reset_index()
+            trend.insert(2, "date", pd.to_datetime({"year": trend["YEAR"], "month": trend["MONTH"], "day": 1}))
+        elif granularity == "week":
+            # weeks start on Monday
+            trend["date"] = trend["date"] - pd.to_timedelta(trend["date"].dt.dayofweek, unit = "D")
+            trend = trend.groupby("date", as_index = False)["n"].sum()
+        elif granularity != "day":
+            raise ValueError("Unknown trend granularity %r, expected 'month', 'week' or 'day'" % granularity)
+        return trend[trend["n"] > 0].reset_index(drop = True)
@@ -1,234 +1,696 @@
+import time
+startup_began = time.perf_counter()
+import atexit
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
-import altair as alt
-import pandas as pd
-import geopandas as gpd
+from dash.dependencies import ClientsideFunction, Input, Output
+import flask
+import functools
 import json
+import os
+import sys
+import threading
+import uuid
 import dash_core_components as dcc
-from helpers import *
-
-alt.data_transformers.disable_max_rows()
-# alt.data_transformers.enable('json')
-#alt.data_transformers.enable('data_server')
-
-geo_json_file_loc= 'data/Boston_Neighborhoods.geojson'
-gdf = get_gpd_df()
-# Import boston crimes
-df = pd.read_csv("data/crime.csv", encoding = 'latin-1')
-# filter for needed columns
-df = df[["DISTRICT", "YEAR", "MONTH", "DAY_OF_WEEK", "HOUR", "OFFENSE_CODE_GROUP"]]
-# map district to neighbourhoods
-df['DISTRICT'] = df['DISTRICT'].replace(
-                                {'A1': 'Downtown',
-                                 'A7': 'East Boston',
-                                 'A15': 'Charleston',
-                                 'B2': 'Roxbury',
-                                 'B3': 'Mattapan',
-                                 'C6': 'South Boston',
-                                 'C11': 'Dorchester',
-                                 'D4': 'South End',
-                                 'D14': 'Brighton',
-                                 'E5': 'West Roxbury',
-                                 'E13': 'Jamaica Plain',
-                                 'E18': 'Hyde Park'})
-# filter out incomplete data from 1st and last month 
-df = df.query('~((YEAR == 2015 & MONTH ==6) | (YEAR == 2018 & MONTH == 9))')
-
-
-# register the custom theme under a chosen name
-alt.themes.register('mds_special', mds_special)
-
-# enable the newly registered theme
-alt.themes.enable('mds_special')
-
-# for dictionary comprehension
-crime_list = list(df['OFFENSE_CODE_GROUP'].unique())
-crime_list.sort()
-neighbourhood_list = list(df['DISTRICT'].unique())
-neighbourhood_list = [x for x in neighbourhood_list if str(x) != 'nan']
-neighbourhood_list.sort()
+from dash.exceptions import PreventUpdate
+from cache import create_cache, filter_key
+from chart_data import ChartDataStore, chart_to_html, chart_to_spec, referenced_data, register_chart_data_route
+from metrics import chart_metrics
+from profiler import SlowRequestProfiler
+from render_pool import ChartPool
+from precompute import load_charts
+from sessions import LatestRequests, SharedLatestRequests
 
+# seconds spent in each startup phase, reported by /readyz
+startup_times = {'dash': round(time.perf_counter() - startup_began, 3)}
+# eager loads the data on import, which gunicorn --preload does once in the
+# master so the forked workers share it, lazy loads it on the first request
+startup_mode = os.environ.get('APP_STARTUP', 'eager')
+data_lock = threading.Lock()
+data_ready = False
+
+# rendered chart html keyed on the chart and its normalized filter state, the
+# disk backend is shared by every gunicorn worker on the host
+cache_backend = os.environ.get('RENDER_CACHE_BACKEND', 'memory')
+cache_dir = os.environ.get('RENDER_CACHE_DIR', 'cache')
+render_cache = create_cache(backend = cache_backend,
+                            directory = cache_dir,
+                            max_entries = int(os.environ.get('RENDER_CACHE_ENTRIES', 256)),
+                            max_bytes = int(os.environ.get('RENDER_CACHE_BYTES', 64 * 1024 * 1024)),
+                            ttl = int(os.environ.get('RENDER_CACHE_TTL', 24 * 60 * 60)))
+# selections with at most this many crimes are answered from the row index
+row_index_threshold = int(os.environ.get('ROW_INDEX_THRESHOLD', 1000))
+
+# datasets of the charts served by url with CHART_DATA_SERVER=on, the store
+# is a directory so it is only shared by workers on the same host
+if os.environ.get('CHART_DATA_SERVER', 'off') == 'on':
+    chart_store = ChartDataStore(os.path.join(cache_dir, 'chart-data'))
+else:
+    chart_store = None
+
+# the disk backend adds the metrics of every gunicorn worker and chart process
+# to one SQLite file, so /metrics does not depend on the worker scraped
+metrics_backend = os.environ.get('METRICS_BACKEND', 'disk')
+if metrics_backend == 'disk':
+    chart_metrics.share(os.path.join(cache_dir, 'metrics.sqlite'))
+elif metrics_backend != 'memory':
+    raise ValueError("Unknown METRICS_BACKEND %r, expected 'memory' or 'disk'" % metrics_backend)
+
+# filled in by load_data()
+dataset_registry = None
+# charts rendered by precompute.py, by cache key
+precomputed_path = os.environ.get('PRECOMPUTED_CHARTS', os.path.join(cache_dir, 'precomputed.pickle'))
+precomputed_charts = {}
+
+def load_data():
+    """
+    Imports the charting libraries and loads the first dataset of the registry,
+    timing every phase in startup_times
+    """
+    global dataset_registry, precomputed_charts
+    began = time.perf_counter()
+    import altair as alt
+    from helpers import compile_chart_templates, mds_special
+    from datasets import DatasetRegistry, read_registry
+    alt.data_transformers.disable_max_rows()
+    # register the custom theme under a chosen name
+    alt.themes.register('mds_special', mds_special)
+
+    # enable the newly registered theme
+    alt.themes.enable('mds_special')
+    startup_times['imports'] = round(time.perf_counter() - began, 3)
+
+    began = time.perf_counter()
+    # validate every chart layout once, requests only fill in their data
+    compile_chart_templates()
+    startup_times['chart templates'] = round(time.perf_counter() - began, 3)
+
+    aggregate_cache = None
+    if cache_backend == 'disk':
+        # the first worker to load a dataset from its csv builds the cube, the others load it from disk
+        aggregate_cache = create_cache(backend = 'disk', directory = cache_dir, name = 'aggregates',
+                                       max_entries = 8, max_bytes = 1024 * 1024 * 1024)
+    # the cities served by the app, each loaded on first use
+    dataset_registry = DatasetRegistry(read_registry(os.environ.get('DATASETS', 'datasets.json')),
+                                       memory_budget = int(os.environ.get('DATASET_MEMORY_BYTES',
+                                                                          1024 * 1024 * 1024)),
+                                       tolerance = float(os.environ.get('GEO_SIMPLIFY_TOLERANCE', 0.0001)),
+                                       precision = int(os.environ.get('GEO_PRECISION', 5)),
+                                       aggregate_cache = aggregate_cache)
+    startup_times.update(dataset_registry.get().times)
+
+    began = time.perf_counter()
+    precomputed_charts = load_charts(precomputed_path, store = chart_store)
+    startup_times['precomputed charts'] = round(time.perf_counter() - began, 3)
+
+def ensure_loaded():
+    """
+    Loads the data unless it is already loaded, requests arriving while it
+    loads wait for it
+    """
+    global data_ready
+    if data_ready:
+        return
+    with data_lock:
+        if not data_ready:
+            load_data()
+            startup_times['total'] = round(sum(startup_times.values()), 3)
+            print("Startup times (s, pid %d): %s" % (os.getpid(), json.dumps(startup_times)),
+                  file = sys.stderr, flush = True)
+            data_ready = True
+
+def get_dataset(dataset_value = None):
+    """
+    Returns a dataset of the registry, by default the first one, loading it on
+    first use and reloading its crime store after an append. A request reads
+    the returned dataset throughout, so its charts and their cache keys come
+    from one version of the crimes.
+    """
+    ensure_loaded()
+    return dataset_registry.get(dataset_value)
+
+if startup_mode == 'eager':
+    ensure_loaded()
+elif startup_mode != 'lazy':
+    raise ValueError("Unknown APP_STARTUP %r, expected 'eager' or 'lazy'" % startup_mode)
+
+
+# iframe sends every chart as a standalone html page, client sends Vega-Lite
+# specs to views that stay on the page, drawn by assets/vega_charts.js
+chart_renderer = os.environ.get('CHART_RENDERER', 'iframe')
+if chart_renderer not in ['iframe', 'client']:
+    raise ValueError("Unknown CHART_RENDERER %r, expected 'iframe' or 'client'" % chart_renderer)
+chart_ids = ['choro-plot', 'trend-plot', 'heatmap-plot', 'bar-plot']
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+external_scripts = []
+if chart_renderer == 'client':
+    # the versions altair writes its specs for, loaded once per page
+    from altair import VEGA_VERSION, VEGALITE_VERSION, VEGAEMBED_VERSION
+    external_scripts = ['https://cdn.jsdelivr.net/npm/vega@%s' % VEGA_VERSION,
+                        'https://cdn.jsdelivr.net/npm/vega-lite@%s' % VEGALITE_VERSION,
+                        'https://cdn.jsdelivr.net/npm/vega-embed@%s' % VEGAEMBED_VERSION]
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, external_scripts=external_scripts)
 server = app.server
 
+@server.route('/cache-stats')
+def cache_stats():
+    stats = render_cache.stats()
+    if chart_pool is not None:
+        # renders shared between concurrent callbacks
+        stats['chart_pool'] = chart_pool.stats()
+    return json.dumps(stats), 200, {'Content-Type': 'application/json'}
+
+@server.route('/metrics')
+def metrics():
+    # the metrics of every worker with METRICS_BACKEND=disk, else of the worker answering the scrape
+    return chart_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@server.route('/healthz')
+def healthz():
+    # the process is up, whether or not the data is loaded
+    return 'ok', 200, {'Content-Type': 'text/plain'}
+
+@server.route('/readyz')
+def readyz():
+    if not data_ready and not data_lock.locked():
+        # a lazy worker starts loading on its first readiness probe
+        threading.Thread(target = ensure_loaded, daemon = True).start()
+    status = {'ready': data_ready, 'mode': startup_mode, 'pid': os.getpid(), 'startup': startup_times}
+    if data_ready:
+        status['datasets'] = dataset_registry.stats()
+    return json.dumps(status), 200 if data_ready else 503, {'Content-Type': 'application/json'}
+
 app.title = 'Boston Crime App'
 
+# serve chart datasets by url instead of inlining them into every chart
+if chart_store is not None:
+    register_chart_data_route(server, chart_store, url_prefix = app.config.routes_pathname_prefix + 'chart-data/')
+    chart_data_url = app.config.requests_pathname_prefix + 'chart-data/'
+else:
+    chart_data_url = None
+render_mode = chart_renderer + ('-url' if chart_store is not None else '-inline')
+
+# write the stacks of callbacks slower than PROFILE_THRESHOLD seconds to PROFILE_DIR
+if os.environ.get('PROFILE_DIR'):
+    profiler = SlowRequestProfiler(os.environ['PROFILE_DIR'],
+                                   threshold = float(os.environ.get('PROFILE_THRESHOLD', 1.0)))
+else:
+    profiler = None
+
+# a newer callback of the same browser session stops the renders of the older
+# ones, which wait CALLBACK_DEBOUNCE seconds first so a burst renders only once.
+# The disk backend shares the latest callbacks between the gunicorn workers,
+# whichever worker answers them.
+session_backend = os.environ.get('SESSION_BACKEND', 'disk')
+if session_backend == 'disk':
+    latest_requests = SharedLatestRequests(os.path.join(cache_dir, 'sessions.sqlite'),
+                                           max_sessions = int(os.environ.get('SESSION_ENTRIES', 10000)))
+elif session_backend == 'memory':
+    latest_requests = LatestRequests(max_sessions = int(os.environ.get('SESSION_ENTRIES', 10000)))
+else:
+    raise ValueError("Unknown SESSION_BACKEND %r, expected 'memory' or 'disk'" % session_backend)
+callback_debounce = float(os.environ.get('CALLBACK_DEBOUNCE', 0))
+
+# CHART_WORKERS > 0 renders the charts of a callback concurrently on threads,
+# or on forked processes sharing the loaded data with CHART_POOL=process
+chart_workers = int(os.environ.get('CHART_WORKERS', 0))
+chart_pool_mode = os.environ.get('CHART_POOL', 'thread')
+chart_pool = None
+chart_pool_lock = threading.Lock()
+
+def get_chart_pool():
+    """
+    Returns the chart pool of this process, created on first use after the
+    data is loaded so gunicorn workers each fork their own chart processes.
+    The pool is shut down when the process exits.
+    """
+    global chart_pool
+    if chart_workers <= 0:
+        return None
+    with chart_pool_lock:
+        if chart_pool is None or chart_pool.pid != os.getpid():
+            ensure_loaded()
+            if chart_pool is not None:
+                # the pool of the parent this process was forked from
+                atexit.unregister(chart_pool.shutdown)
+                chart_pool.shutdown()
+            # the chart processes import the app and load its data themselves
+            chart_pool = ChartPool(workers = chart_workers, mode = chart_pool_mode, preload = [__name__])
+            atexit.register(chart_pool.shutdown)
+        return chart_pool
+
 # colour dictionary
 colors = {"white": "#ffffff",
           "light_grey": "#d2d7df",
           "ubc_blue": "#082145"
           }
 
-app.layout = html.Div(style={'backgroundColor': colors['white']}, children = [
+def chart_container(chart_id):
+    """
+    Returns the component a chart is drawn in, an iframe showing the chart
+    html or a div the client side renderer draws the chart spec in
+    """
+    if chart_renderer == 'iframe':
+        return html.Iframe(
+                    sandbox='allow-scripts',
+                    id=chart_id,
+                    height='400',
+                    width='500',
+                    style={'border-width': '0px'},
+                    )
+    return html.Div(style={'height': '400px', 'width': '500px'}, children = [
+        html.Div(id=chart_id),
+        dcc.Store(id=chart_id + '-spec'),
+    ])
 
-    # HEADER
-    html.Div(className = 'row', style = {'backgroundColor': colors["ubc_blue"], "padding" : 10}, children = [
-        html.H2('Boston Crime Dashboard', style={'color' : colors["white"]}),
-        html.P("This Dash app will allow users to explore crime in Boston acrosss time and space. The data set consists of over 300,000 Boston crime records between 2015 and 2018. Simply drag the sliders to select your desired year range. Select one or multiple values from the drop down menus to select which neighbourhoods or crimes you would like to explore. These options will filter all the graphs in the dashboard.",
-        style={'color' : colors["white"]})
-    ]),
-    
-    # BODY
-    html.Div(className = "row", children = [
-
-         #SIDE BAR
-        html.Div(className = "two columns", style = {'backgroundColor': colors['light_grey'], 'padding': 20}, children= [ 
-            html.P("Filter by Year"),
-            dcc.RangeSlider(
-                    id = 'year-slider',
-                    min=2015,
-                    max=2018,
-                    step=1,
-                    marks={
-                        2015: '2015',
-                        2016: '2016',
-                        2017: '2017',
-                        2018: '2018'
-                        },
-                    value=[2015,2018],
-            ),
-            html.Br(),
+def filter_properties(dataset):
+    """
+    Returns the properties of every filter for a dataset, offering its years,
+    dates, neighbourhoods, crimes and trend granularities with everything
+    selected, the date range is hidden when the crime data has no dates
+    """
+    from helpers import day_date
+    year_range = dataset.year_range
+    if dataset.date_range is not None:
+        first_date, last_date = [day_date(day) for day in dataset.date_range]
+        date_range = {'min_date_allowed': first_date, 'max_date_allowed': last_date,
+                      'start_date': first_date, 'end_date': last_date}
+        date_style = {}
+    else:
+        date_range = {'min_date_allowed': None, 'max_date_allowed': None, 'start_date': None, 'end_date': None}
+        date_style = {'display': 'none'}
+    description = ("This Dash app will allow users to explore crime in %s acrosss time and space. The data set "
+                   "consists of %s %s crime records between %d and %d. Simply drag the sliders to select your desired "
+                   "year range. Select one or multiple values from the drop down menus to select which neighbourhoods "
+                   "or crimes you would like to explore. These options will filter all the graphs in the dashboard."
+                   % (dataset.title, format(len(dataset.df), ','), dataset.title, year_range[0], year_range[1]))
+    return {'dashboard-title': {'children': dataset.title + ' Crime Dashboard'},
+            'dashboard-description': {'children': description},
+            'year-slider': {'min': year_range[0],
+                            'max': year_range[1],
+                            'marks': {year: str(year) for year in range(year_range[0], year_range[1]+1)},
+                            'value': year_range},
+            'month-slider': {'value': [1, 12]},
+            'date-range-filter': {'style': date_style},
+            'date-range': date_range,
+            'neighbourhood-dropdown': {'options': [{'label': neighbourhood.title(), 'value': neighbourhood}
+                                                   for neighbourhood in dataset.neighbourhood_list],
+                                       'value': None},
+            'crime-dropdown': {'options': [{'label': crime.title(), 'value': crime} for crime in dataset.crime_list],
+                               'value': None},
+            'trend-granularity': {'options': [{'label': label, 'value': value}
+                                              for label, value in dataset.trend_granularities],
+                                  'value': 'month'}}
 
-            
+def serve_layout():
+    """
+    Builds the page layout, the filter options come from the crime data so a
+    lazy worker loads it on the first page request
+    """
+    # dash also builds the layout to validate it on the first request, which may be a probe
+    if data_ready or (flask.has_request_context() and flask.request.path not in ['/healthz', '/readyz']):
+        filters = filter_properties(get_dataset())
+        dataset_ids = dataset_registry.ids()
+    else:
+        filters = {component: {} for component in ['dashboard-title', 'dashboard-description', 'year-slider',
+                                                   'month-slider',
+                                                   'date-range-filter', 'date-range', 'neighbourhood-dropdown',
+                                                   'crime-dropdown', 'trend-granularity']}
+        dataset_ids = []
+    return html.Div(style={'backgroundColor': colors['white']}, children = [
 
-            html.Br(),
-            html.P("Filter by Neighbourhood"),
-            dcc.Dropdown(
-                id = 'neighbourhood-dropdown',
-                    options=[{'label': neighbourhood.title(), 'value': neighbourhood} for neighbourhood in neighbourhood_list],
-                    value=None, style=dict(width='100%'),
-                    multi=True          
-                    ),
+        # identifies the page load so its superseded callbacks can be dropped
+        dcc.Store(id='session-id', data=uuid.uuid4().hex),
 
-            html.Br(),
-            html.P("Filter by Crime"),
-            dcc.Dropdown(
-                id = 'crime-dropdown',
-                    options=[{'label': crime.title(), 'value': crime} for crime in crime_list],
-                    value=None, style=dict(width='100%'),
-                    multi=True
-                    ),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(), 
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(), 
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(), 
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(),
-               html.Br(), 
+        # HEADER
+        html.Div(className = 'row', style = {'backgroundColor': colors["ubc_blue"], "padding" : 10}, children = [
+            html.H2(id='dashboard-title', style={'color' : colors["white"]}, **filters['dashboard-title']),
+            html.P(id='dashboard-description', style={'color' : colors["white"]}, **filters['dashboard-description'])
         ]),
-            # MAIN PLOTS
-            html.Div(className = "row", children = [
-                html.Div(className = "five columns", children=[
+    
+        # BODY
+        html.Div(className = "row", children = [
 
-                html.Iframe(
-                    sandbox='allow-scripts',
-                    id='choro-plot',
-                    height='400',
-                    width='500',
-                    style={'border-width': '0px'},
-                    ),
+             #SIDE BAR
+            html.Div(className = "two columns", style = {'backgroundColor': colors['light_grey'], 'padding': 20}, children= [ 
+                # the city picker is only shown when the registry has several datasets
+                html.Div(style={} if len(dataset_ids) > 1 else {'display': 'none'}, children = [
+                    html.P("City"),
+                    dcc.Dropdown(
+                        id = 'dataset-dropdown',
+                            options=[{'label': dataset_registry.configs[dataset_id].get('title', dataset_id),
+                                      'value': dataset_id} for dataset_id in dataset_ids],
+                            value=dataset_ids[0] if dataset_ids else None,
+                            clearable=False, style=dict(width='100%')
+                            ),
+                    html.Br(),
+                ]),
+                html.P("Filter by Year"),
+                dcc.RangeSlider(
+                        id = 'year-slider',
+                        step=1,
+                        updatemode='mouseup',
+                        **filters['year-slider']
+                ),
+                html.Br(),
 
-                html.Iframe(
-                    sandbox='allow-scripts',
-                    id='trend-plot',
-                    height='400',
-                    width='500',
-                    style={'border-width': '0px'},
-                    ),
+                html.P("Filter by Month"),
+                dcc.RangeSlider(
+                        id = 'month-slider',
+                        min=1,
+                        max=12,
+                        step=1,
+                        marks={month: name for month, name in enumerate('JFMAMJJASOND', start=1)},
+                        updatemode='mouseup',
+                        **filters['month-slider']
+                ),
+                html.Br(),
 
+                # only shown when the crime data has the day of every crime
+                html.Div(id = 'date-range-filter', children = [
+                    html.P("Filter by Date"),
+                    dcc.DatePickerRange(
+                        id = 'date-range',
+                            display_format='YYYY-MM-DD',
+                            updatemode='bothdates',
+                            **filters['date-range']
+                            ),
+                ], **filters['date-range-filter']),
+
+                html.Br(),
+                html.P("Filter by Neighbourhood"),
+                dcc.Dropdown(
+                    id = 'neighbourhood-dropdown',
+                        style=dict(width='100%'),
+                        multi=True,
+                        **filters['neighbourhood-dropdown']
+                        ),
+
+                html.Br(),
+                html.P("Filter by Crime"),
+                dcc.Dropdown(
+                    id = 'crime-dropdown',
+                        style=dict(width='100%'),
+                        multi=True,
+                        **filters['crime-dropdown']
+                        ),
+
+                html.Br(),
+                html.P("Crime Trend by"),
+                dcc.RadioItems(
+                    id = 'trend-granularity',
+                        labelStyle={'display': 'inline-block', 'margin-right': 10},
+                        **filters['trend-granularity']
+                        ),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(), 
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(), 
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(), 
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(),
+                   html.Br(), 
             ]),
+                # MAIN PLOTS
+                html.Div(className = "row", children = [
+                    html.Div(className = "five columns", children=[
 
-            html.Div(className = "five columns",  children = [
+                    chart_container('choro-plot'),
 
-                html.Iframe(
-                    sandbox='allow-scripts',
-                    id='heatmap-plot',
-                    height='400',
-                    width='500',
-                    style={'border-width': '0px'},
-                    ),
+                    chart_container('trend-plot'),
+
+                ]),
+
+                html.Div(className = "five columns",  children = [
+
+                    chart_container('heatmap-plot'),
                 
-                html.Iframe(
-                    sandbox='allow-scripts',
-                    id='bar-plot',
-                    height='400',
-                    width='500',
-                    style={'border-width': '0px'},
-                    ),
+                    chart_container('bar-plot'),
 
-            ])
+                ])
             
-            ]),
+                ]),
     
+            ]),
+        # FOOTER
+        html.Div(className = 'row', style = {'backgroundColor': colors["light_grey"], "padding" : 4}, children = [
+            html.P("This dashboard was made collaboratively by the DSCI 532 Group 202 in 2019.",
+            style={'color' : colors["ubc_blue"]}),
+            dcc.Link('Data Source ', href='https://www.kaggle.com/ankkur13/boston-crime-data'),
+            html.Br(),
+            dcc.Link('Github Repo', href='https://github.com/UBC-MDS/DSCI-532_gr202_dashboard')
         ]),
-    # FOOTER
-    html.Div(className = 'row', style = {'backgroundColor': colors["light_grey"], "padding" : 4}, children = [
-        html.P("This dashboard was made collaboratively by the DSCI 532 Group 202 in 2019.",
-        style={'color' : colors["ubc_blue"]}),
-        dcc.Link('Data Source ', href='https://www.kaggle.com/ankkur13/boston-crime-data'),
-        html.Br(),
-        dcc.Link('Github Repo', href='https://github.com/UBC-MDS/DSCI-532_gr202_dashboard')
-    ]),
-])
+    ])
 
-@app.callback(
-        dash.dependencies.Output('choro-plot', 'srcDoc'),
-       [dash.dependencies.Input('year-slider', 'value'),
-       dash.dependencies.Input('neighbourhood-dropdown', 'value'),
-       dash.dependencies.Input('crime-dropdown', 'value')])
+app.layout = serve_layout
 
-def update_choro_plot(year_value, neighbourhood_value, crime_value):
-    return make_choro_plot(df, gdf, year = year_value, neighbourhood = neighbourhood_value, crime = crime_value).to_html()
-    
-@app.callback(
-        dash.dependencies.Output('trend-plot', 'srcDoc'),
-       [dash.dependencies.Input('year-slider', 'value'),
-       dash.dependencies.Input('neighbourhood-dropdown', 'value'),
-       dash.dependencies.Input('crime-dropdown', 'value')])
+def serialize_chart(chart, fragments = None):
+    """
+    Serializes a chart for the renderer, as an html page or a Vega-Lite spec,
+    splicing in the JSON fragments its data holds placeholders of
+    """
+    if chart_renderer == 'client':
+        return chart_to_spec(chart, store = chart_store, url_prefix = chart_data_url, fragments = fragments)
+    return chart_to_html(chart, store = chart_store, url_prefix = chart_data_url, fragments = fragments)
+
+def update_choro_plot(dataset, selection, year_value, neighbourhood_value):
+    from helpers import make_choro_plot
+    chart = make_choro_plot(selection, dataset.gdf, neighbourhood = neighbourhood_value,
+                            features = dataset.geo_features)
+    with chart_metrics.phase('serialize'):
+        return serialize_chart(chart, fragments = dataset.geo_fragments)
+
+def update_trend_plot(dataset, selection, year_value, neighbourhood_value, granularity_value):
+    from helpers import make_trend_plot
+    chart = make_trend_plot(selection, year = year_value, neighbourhood = neighbourhood_value,
+                            granularity = granularity_value)
+    with chart_metrics.phase('serialize'):
+        return serialize_chart(chart)
+
+def update_heatmap_plot(dataset, selection, year_value, neighbourhood_value):
+    from helpers import make_heatmap_plot
+    chart = make_heatmap_plot(selection, neighbourhood = neighbourhood_value)
+    with chart_metrics.phase('serialize'):
+        return serialize_chart(chart)
+
+def update_bar_plot(dataset, selection, year_value, neighbourhood_value):
+    from helpers import make_bar_plot
+    chart = make_bar_plot(selection, neighbourhood = neighbourhood_value)
+    with chart_metrics.phase('serialize'):
+        return serialize_chart(chart)
+
+def track_render(name, render):
+    """
+    Renders a chart, recording the phases run by this thread
+    """
+    with chart_metrics.track(name):
+        return render()
+
+def render_task(update, dataset_value, version, year_value, month_value, date_value, neighbourhood_value,
+                crime_value, options):
+    """
+    Renders a chart from its filter state, run by the chart processes on the
+    data they loaded themselves. A chart process holding another version of
+    the crimes than the cache key of the chart skips it.
+    """
+    dataset = get_dataset(dataset_value)
+    if dataset.version(year_value, month_value) != version:
+        # records were appended while the chart was requested, the next callback renders it
+        raise PreventUpdate
+    selection = select_crimes(dataset, year_value, crime_value, month_value, date_value)
+    return update(dataset, selection, year_value, neighbourhood_value, *options)
 
-def update_trend_plot(year_value, neighbourhood_value, crime_value):
-    return make_trend_plot(df, year = year_value, neighbourhood = neighbourhood_value, crime = crime_value).to_html()
+def render_chart(update, key, render, superseded = None):
+    """
+    Answers a chart from the precomputed charts or the render cache, rendering
+    it on a miss, and records its latency, size and cache result along with the
+    phases of the render. A miss of a superseded request raises PreventUpdate
+    instead of rendering.
+    """
+    began = time.perf_counter()
+    rendered = []
+    def tracked_render():
+        if superseded is not None and superseded():
+            raise PreventUpdate
+        rendered.append(True)
+        pool = get_chart_pool()
+        if pool is None:
+            return track_render(update.__name__, render)
+        return pool.render(key, functools.partial(track_render, update.__name__, render))
+    html = precomputed_charts.get(key)
+    if html is not None:
+        result = 'precomputed'
+    else:
+        html = render_cache.get_or_render(key, tracked_render)
+        result = 'miss' if rendered else 'hit'
+        if result == 'hit' and chart_store is not None and chart_store.touch(referenced_data(html, chart_data_url)):
+            # the datasets of a chart cached longer than they were kept are rendered again
+            html = tracked_render()
+            render_cache.set(key, html)
+            result = 'miss'
+    labels = {'chart': update.__name__}
+    chart_metrics.inc('chart_cache_lookups_total', dict(labels, result = result))
+    chart_metrics.observe('chart_seconds', labels, time.perf_counter() - began)
+    chart_metrics.observe('chart_response_bytes', labels, len(html.encode('utf-8')))
+    return html
+
+def select_crimes(dataset, year_value, crime_value, month_value = None, date_value = None):
+    """
+    Filters the crimes of a dataset once per interaction, the choropleth
+    highlights the neighbourhoods instead of filtering them so that filter is
+    left to each chart. Date ranges are counted from the cumulative counts of
+    the cube.
+    """
+    from helpers import chart_filter
+    with chart_metrics.phase('filter'):
+        selection = chart_filter(dataset.cube, year = year_value, month = month_value, crime = crime_value,
+                                 date = date_value)
+        if selection.total() <= row_index_threshold:
+            # very selective filters are cheaper to answer from the matching rows
+            selection = chart_filter(dataset.crime_index, year = year_value, month = month_value,
+                                     crime = crime_value, date = date_value)
+    return selection
+
+def time_filters(dataset, month_value, date_value):
+    """
+    Returns the month and date filters of a dataset, None for the whole year
+    and for a date range covering every crime so they share the cache entries
+    of no filter. A date range missing an end is open on that side.
+    """
+    if month_value is not None and list(month_value) == [1, 12]:
+        month_value = None
+    if date_value is None or dataset.date_range is None:
+        return month_value, None
+    first, last = dataset.date_range
+    if date_value[0] is not None:
+        first = max(first, date_value[0])
+    if date_value[1] is not None:
+        last = min(last, date_value[1])
+    if [first, last] == dataset.date_range:
+        return month_value, None
+    return month_value, [first, last]
+
+def plot_renders(year_value, neighbourhood_value, crime_value, granularity_value, dataset_value = None,
+                 month_value = None, date_value = None):
+    """
+    Returns the chart function, cache key and render function of every chart
+    for a filter state of a dataset, by default the first one. The date range
+    is given in days since 1970-01-01.
+    """
+    dataset = get_dataset(dataset_value)
+    month_value, date_value = time_filters(dataset, month_value, date_value)
+    version = dataset.version(year_value, month_value)
+    key = (dataset.id,) + version + filter_key(year = year_value, month = month_value,
+                                               neighbourhood = neighbourhood_value, crime = crime_value,
+                                               date = date_value)
+    # only the trend depends on the granularity, the other charts keep their cache entries
+    charts = [(update_choro_plot, ()),
+              (update_trend_plot, (granularity_value,)),
+              (update_heatmap_plot, ()),
+              (update_bar_plot, ())]
+    if chart_workers > 0 and chart_pool_mode == 'process':
+        # the chart processes filter their own copy of the data
+        return [(update, (update.__name__, render_mode) + key + options,
+                 functools.partial(render_task, update, dataset.id, version, year_value, month_value, date_value,
+                                   neighbourhood_value, crime_value, options))
+                for update, options in charts]
+    with chart_metrics.track('update_plots'):
+        selection = select_crimes(dataset, year_value, crime_value, month_value, date_value)
+    return [(update, (update.__name__, render_mode) + key + options,
+             functools.partial(update, dataset, selection, year_value, neighbourhood_value, *options))
+            for update, options in charts]
+
+def render_plots(year_value, neighbourhood_value, crime_value, granularity_value, dataset_value,
+                 month_value = None, date_value = None, superseded = None):
+    renders = plot_renders(year_value, neighbourhood_value, crime_value, granularity_value, dataset_value,
+                           month_value = month_value, date_value = date_value)
+    pool = get_chart_pool()
+    if pool is None:
+        return tuple(render_chart(update, key, render, superseded) for update, key, render in renders)
+    # the charts are independent once the data is filtered
+    return tuple(pool.map(render_chart, [(update, key, render, superseded) for update, key, render in renders]))
+
+# switching the city offers its filter values, which updates the charts
+filter_outputs = [('dashboard-title', 'children'), ('dashboard-description', 'children'),
+                  ('year-slider', 'min'), ('year-slider', 'max'), ('year-slider', 'marks'), ('year-slider', 'value'),
+                  ('month-slider', 'value'), ('date-range-filter', 'style'),
+                  ('date-range', 'min_date_allowed'), ('date-range', 'max_date_allowed'),
+                  ('date-range', 'start_date'), ('date-range', 'end_date'),
+                  ('neighbourhood-dropdown', 'options'), ('neighbourhood-dropdown', 'value'),
+                  ('crime-dropdown', 'options'), ('crime-dropdown', 'value'),
+                  ('trend-granularity', 'options'), ('trend-granularity', 'value')]
 
 @app.callback(
-        dash.dependencies.Output('heatmap-plot', 'srcDoc'),
-       [dash.dependencies.Input('year-slider', 'value'),
-       dash.dependencies.Input('neighbourhood-dropdown', 'value'),
-       dash.dependencies.Input('crime-dropdown', 'value')])
+       [Output(component, prop) for component, prop in filter_outputs],
+       [Input('dataset-dropdown', 'value')])
 
-def update_heatmap_plot(year_value, neighbourhood_value, crime_value):
-    return make_heatmap_plot(df, year = year_value, neighbourhood = neighbourhood_value, crime = crime_value).to_html()
-    
+def update_filters(dataset_value):
+    filters = filter_properties(get_dataset(dataset_value))
+    return [filters[component][prop] for component, prop in filter_outputs]
+
+if chart_renderer == 'client':
+    # the callback fills a store per chart that the browser draws its chart from
+    chart_outputs = [dash.dependencies.Output(chart_id + '-spec', 'data') for chart_id in chart_ids]
+    for chart_id in chart_ids:
+        app.clientside_callback(
+            ClientsideFunction(namespace = 'charts', function_name = 'render'),
+            Output(chart_id, 'className'),
+            [Input(chart_id + '-spec', 'data')],
+            [dash.dependencies.State(chart_id, 'id')])
+else:
+    chart_outputs = [dash.dependencies.Output(chart_id, 'srcDoc') for chart_id in chart_ids]
 
 @app.callback(
-        dash.dependencies.Output('bar-plot', 'srcDoc'),
+       chart_outputs,
        [dash.dependencies.Input('year-slider', 'value'),
+       dash.dependencies.Input('month-slider', 'value'),
+       dash.dependencies.Input('date-range', 'start_date'),
+       dash.dependencies.Input('date-range', 'end_date'),
        dash.dependencies.Input('neighbourhood-dropdown', 'value'),
-       dash.dependencies.Input('crime-dropdown', 'value')])
+       dash.dependencies.Input('crime-dropdown', 'value'),
+       dash.dependencies.Input('trend-granularity', 'value'),
+       dash.dependencies.Input('dataset-dropdown', 'value')],
+       [dash.dependencies.State('session-id', 'data')])
 
-def update_bar_plot(year_value, neighbourhood_value, crime_value):
-    return make_bar_plot(df, year = year_value, neighbourhood = neighbourhood_value, crime = crime_value).to_html()
+def update_plots(year_value, month_value, start_date, end_date, neighbourhood_value, crime_value, granularity_value,
+                 dataset_value, session_id):
+    from helpers import date_days
+    began = time.perf_counter()
+    date_value = [date_days(start_date), date_days(end_date)]
+    generation = latest_requests.start(session_id)
+    superseded = lambda: not latest_requests.is_current(session_id, generation)
+    if callback_debounce > 0:
+        time.sleep(callback_debounce)
+    try:
+        if superseded():
+            raise PreventUpdate
+        if profiler is None:
+            plots = render_plots(year_value, neighbourhood_value, crime_value, granularity_value, dataset_value,
+                                 month_value, date_value, superseded)
+        else:
+            with profiler.profile('update_plots'):
+                plots = render_plots(year_value, neighbourhood_value, crime_value, granularity_value,
+                                     dataset_value, month_value, date_value, superseded)
+    except PreventUpdate:
+        chart_metrics.inc('callbacks_superseded_total', {'callback': 'update_plots'})
+        raise
+    chart_metrics.observe('callback_seconds', {'callback': 'update_plots'}, time.perf_counter() - began)
+    return plots
 
 if __name__ == '__main__':
     app.run_server(debug=True)
-
@@ -0,0 +1,52 @@
+// Draws the Vega-Lite specs sent by the chart callback when CHART_RENDERER=client.
+// Every chart keeps one vega view on the page. When only the data of a chart
+// changed, its datasets are swapped in the view instead of drawing it again.
+(function() {
+    var charts = {};
+
+    function layoutOf(spec) {
+        var layout = Object.assign({}, spec);
+        delete layout.datasets;
+        return JSON.stringify(layout);
+    }
+
+    function canSwap(chart, spec) {
+        if (!chart || !spec.datasets || chart.layout !== layoutOf(spec)) {
+            return false;
+        }
+        // datasets vega parses on load, e.g. dates, need the chart drawn again
+        return Object.keys(spec.datasets).every(function(name) {
+            return chart.swappable[name] === true;
+        });
+    }
+
+    function render(specJson, id) {
+        if (!specJson) {
+            return window.dash_clientside.no_update;
+        }
+        var spec = JSON.parse(specJson);
+        var chart = charts[id];
+        if (canSwap(chart, spec)) {
+            Object.keys(spec.datasets).forEach(function(name) {
+                chart.view.data(name, spec.datasets[name]);
+            });
+            chart.view.runAsync();
+            return 'vega-chart';
+        }
+        vegaEmbed('#' + id, spec, {actions: false}).then(function(result) {
+            if (chart) {
+                chart.view.finalize();
+            }
+            var swappable = {};
+            (result.vgSpec.data || []).forEach(function(data) {
+                swappable[data.name] = data.values !== undefined && data.format === undefined;
+            });
+            charts[id] = {layout: layoutOf(spec), view: result.view, swappable: swappable};
+        });
+        return 'vega-chart';
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        charts: {render: render}
+    });
+})();
@@ -0,0 +1,62 @@
+"""
+Times create_merged_gdf against the iterrows implementation it replaced and
+checks both give the same neighbourhood counts for the choropleth
+
+    python -m benchmarks.choropleth data/crime.csv
+"""
+import argparse
+import timeit
+import pandas as pd
+from helpers import chart_filter, create_merged_gdf, get_gpd_df
+from aggregates import build_cube
+from data_store import read_crime_csv
+
+## FUNCTIONS
+def iterrows_merged_gdf(df, gdf, neighbourhood):
+    """
+    The create_merged_gdf implementation that counted every column and masked
+    the unselected neighbourhoods one row at a time
+    """
+    df = df.groupby(by = 'DISTRICT', observed = True).agg("count")
+    if neighbourhood != []:
+        if neighbourhood != None:
+            neighbourhood = list(neighbourhood)
+            for index_label, row_series in df.iterrows():
+                if index_label not in neighbourhood:
+                    df.at[index_label , 'YEAR'] = None
+    gdf = gdf.merge(df, left_on='Name', right_on='DISTRICT', how='inner')
+    return gdf
+
+def map_counts(gdf):
+    """
+    Returns the neighbourhood names and counts drawn by the choropleth
+    """
+    return gdf[['Name', 'YEAR']].reset_index(drop = True).astype({'YEAR': float})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs = "?", default = "data/crime.csv", help = "location of crime.csv")
+    parser.add_argument("--repeat", type = int, default = 5, help = "timing repetitions, the best is reported")
+    args = parser.parse_args()
+
+    df = read_crime_csv(args.csv)
+    cube = build_cube(df)
+    gdf = get_gpd_df()
+    plain_gdf = gdf.reset_index(drop = True)
+    neighbourhoods = df['DISTRICT'].value_counts().index.tolist()
+    rows = []
+    for name, neighbourhood in [("all", None), ("one", neighbourhoods[:1]), ("five", neighbourhoods[:5])]:
+        filtered = chart_filter(df, year = [2016, 2017])
+        selection = chart_filter(cube, year = [2016, 2017])
+        expected = map_counts(iterrows_merged_gdf(filtered, plain_gdf, neighbourhood))
+        same = (expected.equals(map_counts(create_merged_gdf(filtered, gdf, neighbourhood))) and
+                expected.equals(map_counts(create_merged_gdf(selection, gdf, neighbourhood))))
+        timings = {"iterrows ms": lambda: iterrows_merged_gdf(filtered, plain_gdf, neighbourhood),
+                   "vectorized ms": lambda: create_merged_gdf(filtered, gdf, neighbourhood),
+                   "cube ms": lambda: create_merged_gdf(selection, gdf, neighbourhood)}
+        row = {"neighbourhoods": name}
+        for label, run in timings.items():
+            row[label] = min(timeit.repeat(run, number = 1, repeat = args.repeat)) * 1000
+        row["same output"] = same
+        rows.append(row)
+    print(pd.DataFrame(rows).round(3).to_string(index = False))
@@ -0,0 +1,82 @@
+"""
+Times chart_filter against the DataFrame.query implementation it replaced,
+across filters of increasing selectivity, on the plain and the compact crime
+data, and checks both return the same rows
+
+    python -m benchmarks.filtering data/crime.csv
+"""
+import argparse
+import timeit
+import pandas as pd
+from helpers import chart_filter
+from data_store import clean_crime_data, compact_crime_data
+
+## FUNCTIONS
+def query_filter(df, year = None, month = None, neighbourhood = None, crime = None):
+    """
+    The string built DataFrame.query filter chart_filter used before it
+    combined the filters into a single mask
+    """
+    filtered_df = df
+    if year != None:
+        if type(year) == list:
+            year_list = list(range(year[0], year[1]+1))
+            filtered_df = filtered_df.query('YEAR == %s' % year_list)
+        else:
+            filtered_df = filtered_df.query('YEAR == %s' % year)
+    if month != None:
+        if type(month) == list:
+            month_list = list(range(month[0], month[1]+1))
+            filtered_df = filtered_df.query('MONTH == %s' % month_list)
+        else:
+            filtered_df = filtered_df.query('MONTH == %s' % month)
+    if neighbourhood != None and neighbourhood != []:
+        if type(neighbourhood) == list:
+            filtered_df = filtered_df.query('DISTRICT == %s' % neighbourhood)
+        else:
+            filtered_df = filtered_df.query('DISTRICT == "%s"' % neighbourhood)
+    if crime != None and crime != []:
+        if type(crime) == list:
+            filtered_df = filtered_df.query('OFFENSE_CODE_GROUP == %s' % crime)
+        else:
+            filtered_df = filtered_df.query('OFFENSE_CODE_GROUP == "%s"' % crime)
+    return filtered_df
+
+def filter_cases(df):
+    """
+    Returns filters from the whole data set down to a single neighbourhood,
+    crime and month
+    """
+    years = sorted(df['YEAR'].unique().tolist())
+    neighbourhoods = df['DISTRICT'].value_counts().index.tolist()
+    crimes = df['OFFENSE_CODE_GROUP'].value_counts().index.tolist()
+    return {"all years": dict(year = [years[0], years[-1]]),
+            "one year": dict(year = [years[1], years[1]]),
+            "three neighbourhoods": dict(year = [years[0], years[-1]], neighbourhood = neighbourhoods[:3]),
+            "top crime": dict(year = [years[0], years[-1]], crime = crimes[:1]),
+            "one of everything": dict(year = [years[1], years[1]], month = [3, 3],
+                                      neighbourhood = neighbourhoods[0], crime = crimes[0])}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs = "?", default = "data/crime.csv", help = "location of crime.csv")
+    parser.add_argument("--repeat", type = int, default = 5, help = "timing repetitions, the best is reported")
+    args = parser.parse_args()
+
+    plain = clean_crime_data(pd.read_csv(args.csv, encoding = 'latin-1'))
+    frames = {"plain": plain, "compact": compact_crime_data(plain)}
+    rows = []
+    for frame_name, df in frames.items():
+        for case_name, case in filter_cases(df).items():
+            result = chart_filter(df, **case)
+            same = result.equals(query_filter(df, **case))
+            query_time = min(timeit.repeat(lambda: query_filter(df, **case), number = 1, repeat = args.repeat))
+            mask_time = min(timeit.repeat(lambda: chart_filter(df, **case), number = 1, repeat = args.repeat))
+            rows.append({"frame": frame_name,
+                         "filter": case_name,
+                         "selectivity": len(result) / len(df),
+                         "query ms": query_time * 1000,
+                         "mask ms": mask_time * 1000,
+                         "speedup": query_time / mask_time,
+                         "same rows": same})
+    print(pd.DataFrame(rows).round(3).to_string(index = False))
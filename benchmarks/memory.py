@@ -0,0 +1,50 @@
+"""
+Reports the bytes per crime record used by the plain and the compact in-memory
+representation of the crime data, and checks both produce the same charts
+
+    python -m benchmarks.memory data/crime.csv
+"""
+import argparse
+import altair as alt
+import pandas as pd
+from helpers import create_merged_gdf, crime_bar_chart, get_gpd_df, heatmap, trendgraph
+from data_store import clean_crime_data, compact_crime_data
+
+alt.data_transformers.disable_max_rows()
+
+## FUNCTIONS
+def bytes_per_row(df):
+    """
+    Returns the deep memory usage of each column divided by the number of rows
+    """
+    usage = df.memory_usage(index = False, deep = True)
+    return usage / len(df)
+
+def chart_specs(df, gdf):
+    """
+    Returns the specs of the charts built directly from the crime data
+    """
+    merged = create_merged_gdf(df, gdf, neighbourhood = None)
+    return {"choropleth": merged[["Name", "YEAR"]].to_dict("records"),
+            "trend": trendgraph(df).to_dict(),
+            "heatmap": heatmap(df).to_dict(),
+            "bar": crime_bar_chart(df).to_dict()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs = "?", default = "data/crime.csv", help = "location of crime.csv")
+    parser.add_argument("--skip-charts", action = "store_true", help = "only report the memory usage")
+    args = parser.parse_args()
+
+    before = clean_crime_data(pd.read_csv(args.csv, encoding = 'latin-1'))
+    after = compact_crime_data(before)
+    report = pd.DataFrame({"before": bytes_per_row(before), "after": bytes_per_row(after)})
+    report.loc["total"] = report.sum()
+    print("%d rows, bytes per row" % len(before))
+    print(report.round(1).to_string())
+    print("%.1fx smaller" % (report.loc["total", "before"] / report.loc["total", "after"]))
+
+    if not args.skip_charts:
+        gdf = get_gpd_df()
+        same = chart_specs(before, gdf) == chart_specs(after, gdf)
+        print("charts identical: %s" % same)
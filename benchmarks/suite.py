@@ -0,0 +1,229 @@
+"""
+Times every step of the helpers chart pipeline on synthetic crime data of
+increasing size, from chart_filter to the html of every chart, for the crime
+data frame and the crime cube. Reports the latency percentiles, peak memory and
+output size of each step and writes them to a JSON file. Passing an earlier
+results file with --compare lists the steps that got slower.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --rows 100000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import altair as alt
+import numpy as np
+import pandas as pd
+from helpers import (chart_filter, create_geo_data, create_merged_gdf, crime_bar_chart, get_gpd_df, heatmap,
+                     make_bar_plot, make_choro_plot, make_heatmap_plot, make_trend_plot,
+                     serialize_geo_features, trendgraph, year_filter)
+from aggregates import build_cube
+from chart_templates import TemplatedChart
+from chart_data import chart_to_html
+from benchmarks.synthetic import generate_crime_data
+
+alt.data_transformers.disable_max_rows()
+
+SIZES = [100000, 1000000, 10000000]
+PERCENTILES = [50, 90, 99]
+
+## FUNCTIONS
+def filter_cases(df):
+    """
+    Returns the filter states of the app from everything down to one year,
+    neighbourhood and crime
+    """
+    years = sorted(df['YEAR'].unique().tolist())
+    neighbourhoods = df['DISTRICT'].value_counts().index.tolist()
+    crimes = df['OFFENSE_CODE_GROUP'].value_counts().index.tolist()
+    return {"all": dict(year = [years[0], years[-1]], neighbourhood = None, crime = None),
+            "one year": dict(year = [years[1], years[1]], neighbourhood = None, crime = None),
+            "three neighbourhoods": dict(year = [years[0], years[-1]], neighbourhood = neighbourhoods[:3],
+                                         crime = None),
+            "top crimes": dict(year = [years[0], years[-1]], neighbourhood = None, crime = crimes[:3]),
+            "narrow": dict(year = [years[1], years[1]], neighbourhood = neighbourhoods[:1],
+                           crime = crimes[-1:])}
+
+def pipeline_steps(data, gdf, features, fragments, case):
+    """
+    Returns the steps of the chart pipeline for a filter state, each a name and
+    a function of no arguments, in the order the app runs them
+    """
+    year, neighbourhood, crime = case["year"], case["neighbourhood"], case["crime"]
+    filtered = chart_filter(data, year = year, crime = crime)
+    selected = chart_filter(filtered, neighbourhood = neighbourhood)
+    merged = create_merged_gdf(filtered, gdf, neighbourhood = neighbourhood)
+    single_year = year_filter(year = year)
+    return [("chart_filter", lambda: chart_filter(data, year = year, crime = crime)),
+            ("create_merged_gdf", lambda: create_merged_gdf(filtered, gdf, neighbourhood = neighbourhood)),
+            ("create_geo_data", lambda: create_geo_data(merged, features = features)),
+            ("trendgraph", lambda: trendgraph(selected, filter_1_year = single_year)),
+            ("heatmap", lambda: heatmap(selected)),
+            ("crime_bar_chart", lambda: crime_bar_chart(selected)),
+            ("make_choro_plot html", lambda: chart_to_html(make_choro_plot(data, gdf, year = year,
+                                                                           neighbourhood = neighbourhood,
+                                                                           crime = crime, features = features),
+                                                           fragments = fragments)),
+            ("make_trend_plot html", lambda: make_trend_plot(data, year = year, neighbourhood = neighbourhood,
+                                                             crime = crime).to_html()),
+            ("make_heatmap_plot html", lambda: make_heatmap_plot(data, year = year, neighbourhood = neighbourhood,
+                                                                 crime = crime).to_html()),
+            ("make_bar_plot html", lambda: make_bar_plot(data, year = year, neighbourhood = neighbourhood,
+                                                         crime = crime).to_html())]
+
+def output_size(value):
+    """
+    Returns the size in bytes of a step's output, the JSON spec of a chart and
+    the deep memory usage of a data frame
+    """
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index = False, deep = True).sum())
+    if isinstance(value, (alt.TopLevelMixin, alt.Data, TemplatedChart)):
+        return len(value.to_json().encode('utf-8'))
+    return None
+
+def measure(step, repeat):
+    """
+    Runs a step once to warm up and once under tracemalloc for its peak memory,
+    then times it repeat times
+
+    Returns
+    -------
+    dictionary
+        the latency percentiles and mean in ms, the peak memory and output size in bytes
+    """
+    output = step()
+    tracemalloc.start()
+    step()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        step()
+        times.append((time.perf_counter() - began) * 1000)
+    result = {"p%d_ms" % percentile: float(np.percentile(times, percentile)) for percentile in PERCENTILES}
+    result.update({"mean_ms": float(np.mean(times)),
+                   "runs": repeat,
+                   "peak_bytes": peak,
+                   "output_bytes": output_size(output)})
+    return result
+
+def environment():
+    """
+    Returns the versions and the machine the results were measured with
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "altair": alt.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def run_suite(sizes, inputs, cases, repeat, seed = 0):
+    """
+    Benchmarks the chart pipeline for every data size, input and filter state
+
+    Returns
+    -------
+    dictionary
+        the environment and one result per size, input, filter state and step
+    """
+    gdf = get_gpd_df()
+    features, fragments = serialize_geo_features(gdf)
+    results = []
+    for rows in sizes:
+        began = time.perf_counter()
+        df = generate_crime_data(rows, seed = seed)
+        data = {"frame": df}
+        if "cube" in inputs:
+            data["cube"] = build_cube(df)
+        print("%d rows generated in %.1fs" % (rows, time.perf_counter() - began), file = sys.stderr)
+        for case_name, case in filter_cases(df).items():
+            if cases and case_name not in cases:
+                continue
+            for input_name in inputs:
+                for step_name, step in pipeline_steps(data[input_name], gdf, features, fragments, case):
+                    result = {"rows": rows, "input": input_name, "case": case_name, "step": step_name}
+                    result.update(measure(step, repeat))
+                    results.append(result)
+                    print("%9d %-5s %-20s %-22s p50 %9.2f ms" % (rows, input_name, case_name, step_name,
+                                                                  result["p50_ms"]), file = sys.stderr)
+    return {"environment": environment(),
+            "repeat": repeat,
+            "seed": seed,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "results": results}
+
+def compare_results(results, baseline, threshold = 1.25, noise_ms = 1.0):
+    """
+    Compares the median latency of every step with an earlier run
+
+    Parameters
+    ----------
+    results : dictionary
+        results of run_suite()
+    baseline : dictionary
+        earlier results of run_suite()
+    threshold : float
+        slowdown ratio reported as a regression
+    noise_ms : float
+        slowdowns smaller than this many ms are ignored
+
+    Returns
+    -------
+    Pandas Data Frame
+        the steps measured in both runs with their median latencies, ratio and
+        whether they regressed
+    """
+    key = ["rows", "input", "case", "step"]
+    columns = key + ["p50_ms", "peak_bytes", "output_bytes"]
+    compared = pd.merge(pd.DataFrame(baseline["results"])[columns], pd.DataFrame(results["results"])[columns],
+                        on = key, suffixes = (" before", " after"))
+    compared["ratio"] = compared["p50_ms after"] / compared["p50_ms before"]
+    compared["regression"] = ((compared["ratio"] > threshold) &
+                              (compared["p50_ms after"] - compared["p50_ms before"] > noise_ms))
+    return compared
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type = int, nargs = "+", default = SIZES, help = "synthetic data sizes")
+    parser.add_argument("--inputs", nargs = "+", default = ["frame", "cube"], choices = ["frame", "cube"],
+                        help = "pass the crime data frame, the crime cube or both to the pipeline")
+    parser.add_argument("--cases", nargs = "+", help = "only run these filter states")
+    parser.add_argument("--repeat", type = int, default = 10, help = "timed runs per step")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the synthetic data")
+    parser.add_argument("--output", help = "file to write the JSON results to")
+    parser.add_argument("--compare", help = "earlier JSON results to compare with")
+    parser.add_argument("--threshold", type = float, default = 1.25,
+                        help = "median slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = run_suite(args.rows, args.inputs, args.cases, args.repeat, seed = args.seed)
+    if args.output:
+        with open(args.output, "w") as results_file:
+            json.dump(results, results_file, indent = 1)
+    summary = pd.DataFrame(results["results"])
+    print(summary.round(2).to_string(index = False))
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compared = compare_results(results, json.load(baseline_file), threshold = args.threshold)
+        print(compared.round(2).to_string(index = False))
+        regressions = compared[compared["regression"]]
+        print("%d of %d steps regressed" % (len(regressions), len(compared)))
+        if len(regressions) > 0:
+            sys.exit(1)
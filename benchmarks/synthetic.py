@@ -0,0 +1,110 @@
+"""
+Generates synthetic crime data with the columns and value ranges of the wrangled
+Boston crime data, so the benchmarks and the app run without data/crime.csv.
+The crime types follow a long tailed distribution like the real records.
+
+    python -m benchmarks.synthetic 300000 data/crime.csv
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from data_store import CRIME_COLUMNS, DATE_COLUMN, DAYS_OF_WEEK, DISTRICT_NAMES, INTEGER_DTYPES
+
+# crime types from the most to the least frequent
+CRIME_GROUPS = ["Motor Vehicle Accident Response", "Larceny", "Medical Assistance", "Investigate Person",
+                "Other", "Drug Violation", "Simple Assault", "Vandalism", "Verbal Disputes", "Towed",
+                "Investigate Property", "Larceny From Motor Vehicle", "Property Lost", "Warrant Arrests",
+                "Aggravated Assault", "Violations", "Fraud", "Residential Burglary", "Missing Person Located",
+                "Auto Theft", "Robbery", "Harassment", "Property Found", "Missing Person Reported",
+                "Confidence Games", "Police Service Incidents", "Disorderly Conduct", "Fire Related Reports",
+                "Firearm Violations", "License Violation", "Restraining Order Violations",
+                "Recovered Stolen Property", "Liquor Violation", "Counterfeiting", "Landlord/Tenant Disputes",
+                "Ballistics", "Commercial Burglary", "Assembly or Gathering Violations",
+                "Operating Under the Influence", "Other Burglary", "Embezzlement", "Search Warrants",
+                "Harbor Related Incidents", "Firearm Discovery", "Evading Fare", "Prisoner Related Incidents",
+                "Prostitution", "Phone Call Complaints", "Bomb Hoax", "Explosives", "Criminal Harassment",
+                "Homicide", "Arson", "Aircraft", "Gambling", "Manslaughter", "Biological Threat"]
+# complete months of the Boston crime data
+FIRST_DAY = "2015-07-01"
+LAST_DAY = "2018-08-31"
+# share of the records without a district
+MISSING_DISTRICT = 0.005
+
+## FUNCTIONS
+def generate_crime_data(rows, seed = 0, chunk_size = 1000000):
+    """
+    Generates compact crime data like read_crime_csv() returns
+
+    Parameters
+    ----------
+    rows : int
+        number of crime records
+    seed : int
+        seed of the random generator, the same seed gives the same data
+    chunk_size : int
+        records generated at a time, bounds the temporary memory
+
+    Returns
+    -------
+    Pandas Data Frame
+        crime data with categorical and uint columns and the DATE of each crime
+    """
+    rng = np.random.RandomState(seed)
+    first_day = (pd.Timestamp(FIRST_DAY) - pd.Timestamp(0)).days
+    days = (pd.Timestamp(LAST_DAY) - pd.Timestamp(FIRST_DAY)).days + 1
+    neighbourhoods = sorted(DISTRICT_NAMES.values())
+    crimes = sorted(CRIME_GROUPS)
+    crime_weights = 1 / np.arange(1, len(CRIME_GROUPS) + 1)
+    crime_codes = pd.Index(crimes).get_indexer(CRIME_GROUPS)
+    # fewer crimes at night
+    hour_weights = np.array([4, 3, 2, 2, 1, 1, 2, 3, 4, 5, 5, 6, 7, 6, 6, 6, 7, 7, 6, 6, 5, 5, 5, 4], dtype = float)
+    chunks = []
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        date = first_day + rng.randint(0, days, size)
+        dates = pd.DatetimeIndex(date.astype("datetime64[D]"))
+        district = rng.randint(0, len(neighbourhoods), size).astype(np.int8)
+        district[rng.random_sample(size) < MISSING_DISTRICT] = -1
+        chunks.append({"DISTRICT": district,
+                       "YEAR": dates.year.to_numpy(),
+                       "MONTH": dates.month.to_numpy(),
+                       "DAY_OF_WEEK": dates.dayofweek.to_numpy().astype(np.int8),
+                       "HOUR": rng.choice(24, size, p = hour_weights / hour_weights.sum()),
+                       "OFFENSE_CODE_GROUP": crime_codes[rng.choice(len(CRIME_GROUPS), size,
+                                                                    p = crime_weights / crime_weights.sum())
+                                                         ].astype(np.int8),
+                       DATE_COLUMN: date})
+    values = {column: np.concatenate([chunk[column] for chunk in chunks]) for column in chunks[0]}
+    categories = {"DISTRICT": neighbourhoods, "DAY_OF_WEEK": DAYS_OF_WEEK, "OFFENSE_CODE_GROUP": crimes}
+    data = {}
+    for column in CRIME_COLUMNS + [DATE_COLUMN]:
+        if column in categories:
+            data[column] = pd.Categorical.from_codes(values[column], categories = categories[column])
+        else:
+            data[column] = values[column].astype(INTEGER_DTYPES[column])
+    return pd.DataFrame(data)
+
+def write_crime_csv(df, path):
+    """
+    Writes crime data in the format of the Boston crime.csv, with district codes
+    and OCCURRED_ON_DATE, so it can be read by read_crime_csv()
+    """
+    district_codes = {name: code for code, name in DISTRICT_NAMES.items()}
+    dates = pd.to_datetime(df[DATE_COLUMN].to_numpy().astype(np.int64), unit = "D")
+    dates = dates + pd.to_timedelta(df["HOUR"].to_numpy().astype(np.int64), unit = "h")
+    raw = pd.DataFrame({"OFFENSE_CODE_GROUP": df["OFFENSE_CODE_GROUP"],
+                        "DISTRICT": df["DISTRICT"].map(district_codes),
+                        "OCCURRED_ON_DATE": dates.strftime("%Y-%m-%d %H:%M:%S"),
+                        "YEAR": df["YEAR"],
+                        "MONTH": df["MONTH"],
+                        "DAY_OF_WEEK": df["DAY_OF_WEEK"],
+                        "HOUR": df["HOUR"]})
+    raw.to_csv(path, index = False, encoding = "latin-1")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rows", type = int, help = "number of crime records")
+    parser.add_argument("csv", nargs = "?", default = "data/crime.csv", help = "location of the csv to write")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the random generator")
+    args = parser.parse_args()
+    write_crime_csv(generate_crime_data(args.rows, seed = args.seed), args.csv)
@@ -0,0 +1,278 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+## FUNCTIONS
+def filter_key(year = None, month = None, neighbourhood = None, crime = None, date = None):
+    """
+    Creates a canonical key for the filter state so equivalent selections share
+    a cache entry, e.g. [A, B] and [B, A] or None and []
+
+    Parameters
+    ----------
+    year : int or list
+        year or range of years selected
+    month : int or list
+        month or range of months selected
+    neighbourhood : string or list
+        neighbourhood or neighbourhoods selected
+    crime : string or list
+        crime or crimes selected
+    date : int or list
+        day or range of days selected
+
+    Returns
+    -------
+    tuple
+        hashable key of the filter state
+    """
+    def span(value):
+        if value is None:
+            return None
+        if type(value) == list:
+            return (value[0], value[1])
+        return (value, value)
+
+    def choice(value):
+        if value is None:
+            return ()
+        if type(value) == list:
+            return tuple(sorted(set(value)))
+        return (value,)
+
+    return (span(year), span(month), choice(neighbourhood), choice(crime), span(date))
+
+class RenderCache:
+    """
+    In-process LRU cache of rendered chart html bounded by the number of
+    entries and their total size in bytes
+    """
+    def __init__(self, max_entries = 256, max_bytes = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached html for the key or None, marking it as recently used
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """
+        Stores the html for the key, evicting the least recently used entries
+        until the cache fits its bounds
+        """
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last = False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        """
+        Returns the cached html for the key, calling render() to create and
+        store it on a miss
+
+        Parameters
+        ----------
+        key : tuple
+            hashable key of the chart and its filter state
+        render : function
+            function returning the chart html
+
+        Returns
+        -------
+        string
+            the chart html
+        """
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        """
+        Returns the hit, miss and eviction counters along with the current size
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries),
+                    "bytes": self.bytes,
+                    "max_entries": self.max_entries,
+                    "max_bytes": self.max_bytes}
+
+class DiskCache:
+    """
+    SQLite backed cache shared by every worker process on the host. Values are
+    pickled so it can hold rendered chart html as well as aggregates. Entries
+    expire after ttl seconds and the least recently used entries are evicted
+    once the store exceeds max_entries or max_bytes.
+    """
+    def __init__(self, path, max_entries = 1024, max_bytes = 256 * 1024 * 1024, ttl = 24 * 60 * 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                       "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def connect(self):
+        """
+        Returns the sqlite connection of the calling thread, connections are
+        not shared across threads or forked processes
+        """
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout = 30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        """
+        Returns the cached value for the key or None, marking it as recently used
+        """
+        now = time.time()
+        db = self.connect()
+        row = db.execute("SELECT value, created FROM entries WHERE key = ?", (repr(key),)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                with db:
+                    db.execute("DELETE FROM entries WHERE key = ?", (repr(key),))
+            self.misses += 1
+            return None
+        with db:
+            db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, repr(key)))
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Stores the value for the key, dropping expired entries and evicting the
+        least recently used ones until the store fits its bounds
+        """
+        blob = pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        db = self.connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                       (repr(key), sqlite3.Binary(blob), len(blob), now, now))
+            self.evictions += db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,)).rowcount
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            while entries > self.max_entries or size > self.max_bytes:
+                evicted_key, evicted_size = db.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed LIMIT 1").fetchone()
+                db.execute("DELETE FROM entries WHERE key = ?", (evicted_key,))
+                entries -= 1
+                size -= evicted_size
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        """
+        Returns the cached value for the key, calling render() to create and
+        store it on a miss
+
+        Parameters
+        ----------
+        key : tuple
+            hashable key of the value, its repr is used as the stored key
+        render : function
+            function returning the value
+
+        Returns
+        -------
+        object
+            the cached or rendered value
+        """
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        """
+        Returns this process's hit, miss and eviction counters along with the
+        current size of the shared store
+        """
+        entries, size = self.connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl}
+
+def create_cache(backend = "memory", directory = "cache", name = "charts", max_entries = 256,
+                 max_bytes = 64 * 1024 * 1024, ttl = 24 * 60 * 60):
+    """
+    Creates a chart cache for the chosen backend
+
+    Parameters
+    ----------
+    backend : string
+        "memory" for a per-process LRU or "disk" for a store shared by every worker
+    directory : string
+        directory holding the disk store
+    name : string
+        name of the disk store file within the directory
+    max_entries : int
+        maximum number of cached entries
+    max_bytes : int
+        maximum total size of the cached entries
+    ttl : int
+        seconds before a disk entry expires
+
+    Returns
+    -------
+    RenderCache or DiskCache
+        the cache for the backend
+    """
+    if backend == "memory":
+        return RenderCache(max_entries = max_entries, max_bytes = max_bytes)
+    if backend == "disk":
+        return DiskCache(os.path.join(directory, name + ".sqlite"), max_entries = max_entries,
+                         max_bytes = max_bytes, ttl = ttl)
+    raise ValueError("Unknown cache backend %r, expected 'memory' or 'disk'" % backend)
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from flask import abort, send_from_directory
+from files import replace_file
+
+## FUNCTIONS
+class ChartDataStore:
+    """
+    Directory of chart datasets named by the hash of their content, shared by
+    every worker on the host. Datasets are immutable so browsers can cache them
+    indefinitely, files not used for max_age seconds are pruned. Serving a
+    cached chart marks its datasets as used and pinned datasets, those of the
+    precomputed charts, are never pruned.
+    """
+    def __init__(self, directory, max_age = 7 * 24 * 60 * 60, prune_every = 100):
+        self.directory = directory
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self.writes = 0
+        self.pinned = set()
+        # when each dataset was last marked as used by this process
+        self.touched = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".json")
+
+    def put(self, name, values, fragments = None):
+        """
+        Stores the values of a dataset unless a dataset with the same content
+        hash is already stored, in which case it is marked as recently used.
+        The placeholders of fragments in the values are stored as the JSON
+        fragments they stand for.
+        """
+        path = self.path(name)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        # no worker serves a partial dataset
+        with replace_file(path) as data_file:
+            data_file.write(splice_fragments(json.dumps(values, separators = (",", ":")), fragments))
+        self.writes += 1
+        if self.writes % self.prune_every == 0:
+            self.prune()
+
+    def get(self, name):
+        """
+        Returns the values of a stored dataset
+        """
+        with open(self.path(name)) as data_file:
+            return json.load(data_file)
+
+    def touch(self, names):
+        """
+        Marks the datasets of a chart served from a cache as recently used, at
+        most once an hour per dataset
+
+        Returns
+        -------
+        list
+            the names of the datasets that are no longer stored
+        """
+        now = time.time()
+        missing = []
+        for name in names:
+            with self.lock:
+                if now - self.touched.get(name, 0) < 60 * 60:
+                    continue
+                self.touched[name] = now
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                with self.lock:
+                    del self.touched[name]
+                missing.append(name)
+        return missing
+
+    def pin(self, datasets):
+        """
+        Stores datasets by name and keeps them from being pruned
+        """
+        for name, values in datasets.items():
+            self.put(name, values)
+            self.pinned.add(name + ".json")
+
+    def prune(self):
+        """
+        Deletes the datasets that have not been used for max_age seconds
+        """
+        oldest = time.time() - self.max_age
+        for entry in os.scandir(self.directory):
+            if entry.name not in self.pinned and entry.stat().st_mtime < oldest:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+def dataset_name(values):
+    """
+    Names a dataset by the hash of its values the same way altair names the
+    datasets it consolidates
+    """
+    values_json = json.dumps(values, sort_keys = True)
+    return "data-" + hashlib.md5(values_json.encode()).hexdigest()
+
+def fragment_placeholder(fragment):
+    """
+    Returns the string standing in for a serialized JSON fragment in chart
+    data until the chart is serialized, named by the hash of the fragment so
+    datasets holding different fragments never share a name
+    """
+    return "fragment-" + hashlib.md5(fragment.encode()).hexdigest()
+
+fragment_pattern = re.compile(r'"(fragment-[0-9a-f]{32})"')
+
+def splice_fragments(text, fragments):
+    """
+    Replaces the quoted placeholders in a serialized chart or dataset with the
+    JSON fragments they stand for
+
+    Parameters
+    ----------
+    text : string
+        chart html, spec or dataset JSON
+    fragments : dictionary
+        JSON fragments by their fragment_placeholder(), None leaves text as is
+
+    Returns
+    -------
+    string
+        the text holding the fragments
+    """
+    if not fragments:
+        return text
+    return fragment_pattern.sub(lambda match: fragments[match.group(1)], text)
+
+def referenced_data(chart, url_prefix):
+    """
+    Returns the names of the stored datasets a chart html page or spec loads
+    from url_prefix
+    """
+    return sorted(set(re.findall(re.escape(url_prefix) + r"(data-[0-9a-f]+)\.json", chart)))
+
+def publish_data(spec, datasets, store, url_prefix, fragments = None):
+    """
+    Moves the named datasets and inline values referenced by a chart spec to
+    the store, replacing the references with their urls
+    """
+    if isinstance(spec, dict):
+        data = spec.get("data")
+        if isinstance(data, dict):
+            if data.get("name") in datasets:
+                name, values = data["name"], datasets[data["name"]]
+            elif "values" in data:
+                name, values = dataset_name(data["values"]), data["values"]
+            else:
+                name = None
+            if name is not None:
+                store.put(name, values, fragments)
+                reference = {key: value for key, value in data.items() if key not in ("name", "values")}
+                reference["url"] = url_prefix + name + ".json"
+                spec["data"] = reference
+        for value in spec.values():
+            publish_data(value, datasets, store, url_prefix, fragments)
+    elif isinstance(spec, list):
+        for value in spec:
+            publish_data(value, datasets, store, url_prefix, fragments)
+
+def chart_to_html(chart, store = None, url_prefix = "/chart-data/", fragments = None):
+    """
+    Renders a chart as a standalone html page. With a store the inline
+    datasets are moved to it and the chart loads them from url_prefix, so the
+    page stays small however much data the chart shows.
+
+    Parameters
+    ----------
+    chart : altair plot
+        chart to render
+    store : ChartDataStore
+        store to publish the chart datasets to, None keeps them inline
+    url_prefix : string
+        url the store is served from
+    fragments : dictionary
+        JSON fragments by the placeholders standing for them in the chart data
+
+    Returns
+    -------
+    string
+        the chart html
+    """
+    if store is None:
+        return splice_fragments(chart.to_html(), fragments)
+    # charts are only rendered once altair is imported, importing it here keeps app startup lazy
+    import altair as alt
+    spec = chart.to_dict()
+    publish_data(spec, spec.pop("datasets", {}), store, url_prefix, fragments)
+    return alt.utils.spec_to_html(spec, mode = "vega-lite",
+                                  vegalite_version = alt.VEGALITE_VERSION,
+                                  vegaembed_version = alt.VEGAEMBED_VERSION,
+                                  vega_version = alt.VEGA_VERSION)
+
+def collect_datasets(spec, datasets, collected, names):
+    """
+    Moves the named datasets and inline values referenced by a chart spec to
+    collected, naming them by the order they appear in the spec
+
+    Parameters
+    ----------
+    spec : dictionary
+        chart spec, changed in place
+    datasets : dictionary
+        the datasets of the spec by their altair name
+    collected : dictionary
+        filled with the datasets by their new name
+    names : dictionary
+        filled with the new name of every altair name
+    """
+    if isinstance(spec, dict):
+        data = spec.get("data")
+        if isinstance(data, dict) and (data.get("name") in datasets or "values" in data):
+            if data.get("name") in datasets:
+                if data["name"] not in names:
+                    names[data["name"]] = "chart_data_%d" % len(collected)
+                    collected[names[data["name"]]] = datasets[data["name"]]
+                name = names[data["name"]]
+            else:
+                name = "chart_data_%d" % len(collected)
+                collected[name] = data["values"]
+            reference = {key: value for key, value in data.items() if key not in ("name", "values")}
+            reference["name"] = name
+            spec["data"] = reference
+        for value in spec.values():
+            collect_datasets(value, datasets, collected, names)
+    elif isinstance(spec, list):
+        for value in spec:
+            collect_datasets(value, datasets, collected, names)
+
+def chart_to_spec(chart, store = None, url_prefix = "/chart-data/", fragments = None):
+    """
+    Serializes a chart to its Vega-Lite JSON spec for the client side renderer.
+    The datasets are named by their order in the spec instead of the hash of
+    their values, so the spec of a chart only changes with its data when the
+    filters change and the browser can swap the data of the chart it shows.
+
+    Parameters
+    ----------
+    chart : altair plot
+        chart to serialize
+    store : ChartDataStore
+        store to publish the chart datasets to, None keeps them inline
+    url_prefix : string
+        url the store is served from
+    fragments : dictionary
+        JSON fragments by the placeholders standing for them in the chart data
+
+    Returns
+    -------
+    string
+        the compact JSON spec
+    """
+    spec = chart.to_dict()
+    datasets = spec.pop("datasets", {})
+    if store is not None:
+        publish_data(spec, datasets, store, url_prefix, fragments)
+    else:
+        collected = {}
+        collect_datasets(spec, datasets, collected, {})
+        spec["datasets"] = collected
+    return splice_fragments(json.dumps(spec, separators = (",", ":")), fragments)
+
+def register_chart_data_route(server, store, url_prefix = "/chart-data/"):
+    """
+    Serves the datasets of a ChartDataStore from the Flask server
+
+    Parameters
+    ----------
+    server : Flask app
+        the server of the Dash app
+    store : ChartDataStore
+        store to serve
+    url_prefix : string
+        url to serve the store from
+    """
+    @server.route(url_prefix + "<name>.json")
+    def chart_data(name):
+        if not name.startswith("data-"):
+            abort(404)
+        response = send_from_directory(os.path.abspath(store.directory), name + ".json",
+                                       mimetype = "application/json")
+        # the content never changes for a name, browsers may keep it for good
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        # charts render in sandboxed iframes whose requests have no origin
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        return response
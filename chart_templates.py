@@ -0,0 +1,134 @@
+import copy
+import json
+import threading
+import altair as alt
+import pandas as pd
+from chart_data import dataset_name
+
+## FUNCTIONS
+def data_paths(spec, datasets, path = ()):
+    """
+    Returns the paths to the parts of a chart spec that hold chart data, a
+    reference to one of the datasets or inline values
+    """
+    paths = []
+    if isinstance(spec, dict):
+        data = spec.get("data")
+        if isinstance(data, dict) and (data.get("name") in datasets or "values" in data):
+            paths.append(path)
+        for key, value in spec.items():
+            if key != "data":
+                paths += data_paths(value, datasets, path + (key,))
+    elif isinstance(spec, list):
+        for position, value in enumerate(spec):
+            paths += data_paths(value, datasets, path + (position,))
+    return paths
+
+def chart_data(data):
+    """
+    Converts chart data the way altair writes it into a spec, data frames go
+    through the active data transformer and become named datasets
+
+    Returns
+    -------
+    tuple
+        the data of the spec and the datasets it references by name
+    """
+    if isinstance(data, pd.DataFrame):
+        data = alt.data_transformers.get()(data)
+        if "values" in data and alt.data_transformers.consolidate_datasets:
+            name = dataset_name(data["values"])
+            reference = {key: value for key, value in data.items() if key != "values"}
+            reference["name"] = name
+            return reference, {name: data["values"]}
+        return data, {}
+    if isinstance(data, alt.Data):
+        return data.to_dict(validate = False), {}
+    return data, {}
+
+def empty_data(data):
+    """
+    Returns chart data of the same kind and columns without any rows
+    """
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[:0]
+    if isinstance(data, alt.Data):
+        return alt.Data(values = [])
+    return data
+
+class SpecTemplate:
+    """
+    Validated Vega-Lite spec of a chart without its data, compiled once by
+    altair so charts of the same layout only have their data filled in
+    """
+    def __init__(self, chart):
+        spec = chart.to_dict()
+        self.skeleton = spec
+        self.paths = data_paths(spec, spec.pop("datasets", {}))
+
+    def fill(self, data):
+        """
+        Returns the chart of the template showing data, without validating it
+        """
+        return TemplatedChart(self, *chart_data(data))
+
+class TemplatedChart:
+    """
+    Chart filled in from a SpecTemplate with the to_dict, to_json and to_html
+    methods of an altair chart
+    """
+    def __init__(self, template, data, datasets):
+        self.template = template
+        self.data = data
+        self.datasets = datasets
+
+    def to_dict(self):
+        # only the small skeleton is copied, callers may change the spec in place
+        spec = copy.deepcopy(self.template.skeleton)
+        for path in self.template.paths:
+            part = spec
+            for key in path:
+                part = part[key]
+            part["data"] = dict(self.data)
+        if self.datasets:
+            spec["datasets"] = dict(self.datasets)
+        return spec
+
+    def to_json(self, indent = 2, sort_keys = True):
+        return json.dumps(self.to_dict(), indent = indent, sort_keys = sort_keys)
+
+    def to_html(self):
+        return alt.utils.spec_to_html(self.to_dict(), mode = "vega-lite",
+                                      vegalite_version = alt.VEGALITE_VERSION,
+                                      vegaembed_version = alt.VEGAEMBED_VERSION,
+                                      vega_version = alt.VEGA_VERSION)
+
+templates = {}
+templates_lock = threading.Lock()
+
+def fill_template(key, draw, data):
+    """
+    Returns the chart draw(data) would make, drawing and validating it with
+    altair only the first time a key is used under the active theme
+
+    Parameters
+    ----------
+    key : tuple
+        the chart and the arguments of draw that change its layout
+    draw : function
+        draws the chart of some data with altair
+    data : Pandas Data Frame or altair Data
+        data of the chart
+
+    Returns
+    -------
+    TemplatedChart
+        the chart showing data
+    """
+    key = key + (alt.themes.active,)
+    template = templates.get(key)
+    if template is None:
+        template = SpecTemplate(draw(empty_data(data)))
+        with templates_lock:
+            template = templates.setdefault(key, template)
+    return template.fill(data)
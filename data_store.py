@@ -0,0 +1,753 @@
+import argparse
+import fcntl
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from aggregates import (CrimeCube, CUBE_DIMENSIONS, add_day_counts, axis_codes, build_cube, cumulate_days,
+                        cumulative_dtype, day_count_array, merge_cubes)
+from files import replace_file
+from row_index import CrimeIndex, INDEXED_COLUMNS, build_postings, merge_postings, segment_postings
+
+# columns of the crime data used by the app
+CRIME_COLUMNS = ["DISTRICT", "YEAR", "MONTH", "DAY_OF_WEEK", "HOUR", "OFFENSE_CODE_GROUP"]
+# police district codes mapped to neighbourhoods
+DISTRICT_NAMES = {'A1': 'Downtown',
+                  'A7': 'East Boston',
+                  'A15': 'Charleston',
+                  'B2': 'Roxbury',
+                  'B3': 'Mattapan',
+                  'C6': 'South Boston',
+                  'C11': 'Dorchester',
+                  'D4': 'South End',
+                  'D14': 'Brighton',
+                  'E5': 'West Roxbury',
+                  'E13': 'Jamaica Plain',
+                  'E18': 'Hyde Park'}
+# incomplete first and last month of the Boston crime.csv
+PARTIAL_MONTHS = ["2015-06", "2018-09"]
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# storage width of the integer columns
+INTEGER_DTYPES = {"YEAR": np.uint16, "MONTH": np.uint8, "HOUR": np.uint8, "DATE": np.uint16}
+# storage widths of the categorical codes, the first one whose maximum exceeds the
+# number of categories is used, as pandas picks the width of the codes it makes
+CODE_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+# optional day of the crime in days since 1970-01-01, used by the weekly and daily trends
+DATE_COLUMN = "DATE"
+STORE_VERSION = 5
+# text columns of crime.csv, read as strings in every chunk so the chunks agree
+TEXT_COLUMNS = ["DISTRICT", "OFFENSE_CODE_GROUP", "DAY_OF_WEEK", "OCCURRED_ON_DATE"]
+# rows of crime.csv read at a time
+CHUNK_SIZE = 500000
+
+## FUNCTIONS
+def clean_crime_data(df, partial_months = PARTIAL_MONTHS, district_names = DISTRICT_NAMES):
+    """
+    Wrangles the raw Boston crime records into the columns used by the app
+
+    Parameters
+    ----------
+    df : Pandas Data Frame
+        raw crime records as read from crime.csv
+    partial_months : list
+        incomplete months of the csv to drop as 'YYYY-MM', new batches of
+        records keep every month
+    district_names : dictionary
+        neighbourhood name of every police district code
+
+    Returns
+    -------
+    Pandas Data Frame
+        crime data with neighbourhood names and the incomplete months removed,
+        along with the DATE of each crime when the records have OCCURRED_ON_DATE
+    """
+    dates = None
+    if 'OCCURRED_ON_DATE' in df.columns:
+        dates = pd.to_datetime(df['OCCURRED_ON_DATE'].str[:10], format = '%Y-%m-%d')
+    # filter for needed columns
+    df = df[CRIME_COLUMNS]
+    if dates is not None:
+        df[DATE_COLUMN] = (dates - pd.Timestamp(0)).dt.days
+    # map district to neighbourhoods
+    df['DISTRICT'] = df['DISTRICT'].replace(district_names)
+    # filter out incomplete data from 1st and last month
+    if partial_months:
+        partial = np.zeros(len(df), dtype = bool)
+        for period in partial_months:
+            year, month = [int(part) for part in period.split("-")]
+            partial |= ((df['YEAR'] == year) & (df['MONTH'] == month)).to_numpy()
+        df = df[~partial]
+    return df
+
+def compact_crime_data(df):
+    """
+    Converts the crime data to a compact in-memory representation. String
+    columns become categoricals with a fixed category order and integer columns
+    use the smallest unsigned width that holds them.
+
+    Parameters
+    ----------
+    df : Pandas Data Frame
+        crime data with the columns in CRIME_COLUMNS
+
+    Returns
+    -------
+    Pandas Data Frame
+        the same crime data using categorical and uint8/uint16 columns
+    """
+    data = {}
+    for column in crime_columns(df):
+        if column in INTEGER_DTYPES:
+            data[column] = df[column].to_numpy().astype(INTEGER_DTYPES[column])
+        else:
+            if column == "DAY_OF_WEEK":
+                categories = DAYS_OF_WEEK
+            else:
+                categories = sorted(df[column].dropna().unique())
+            data[column] = pd.Categorical(df[column], categories = categories)
+    return pd.DataFrame(data, columns = list(data), index = df.index)
+
+def crime_columns(df):
+    """
+    Returns the columns of CRIME_COLUMNS along with DATE when the data has it
+    """
+    if DATE_COLUMN in df.columns:
+        return CRIME_COLUMNS + [DATE_COLUMN]
+    return CRIME_COLUMNS
+
+def read_crime_chunks(path, partial_months = PARTIAL_MONTHS, district_names = DISTRICT_NAMES, chunk_size = CHUNK_SIZE):
+    """
+    Reads and wrangles the Boston crime csv chunk_size rows at a time, parsing
+    only the columns used by the app
+
+    Parameters
+    ----------
+    path : string
+        location of crime.csv
+    partial_months : list
+        incomplete months of the csv to drop as 'YYYY-MM'
+    district_names : dictionary
+        neighbourhood name of every police district code
+    chunk_size : int
+        rows read at a time
+
+    Returns
+    -------
+    generator
+        the wrangled crime data of every chunk
+    """
+    header = pd.read_csv(path, encoding = 'latin-1', nrows = 0).columns
+    usecols = [column for column in CRIME_COLUMNS + ['OCCURRED_ON_DATE'] if column in header]
+    chunks = pd.read_csv(path, encoding = 'latin-1', usecols = usecols, chunksize = chunk_size,
+                         dtype = {column: str for column in TEXT_COLUMNS if column in usecols})
+    for chunk in chunks:
+        yield clean_crime_data(chunk, partial_months = partial_months, district_names = district_names)
+
+def read_crime_csv(path, partial_months = PARTIAL_MONTHS, district_names = DISTRICT_NAMES, chunk_size = CHUNK_SIZE):
+    """
+    Reads and wrangles the Boston crime csv. The text columns of every chunk
+    are stored as categories, so only one chunk is ever held as strings.
+
+    Parameters
+    ----------
+    path : string
+        location of crime.csv
+    partial_months : list
+        incomplete months of the csv to drop as 'YYYY-MM'
+    district_names : dictionary
+        neighbourhood name of every police district code
+    chunk_size : int
+        rows read at a time
+
+    Returns
+    -------
+    Pandas Data Frame
+        compact crime data with the columns used by the app
+    """
+    chunks = []
+    for chunk in read_crime_chunks(path, partial_months = partial_months,
+                                   district_names = district_names, chunk_size = chunk_size):
+        chunks.append(chunk.astype({column: "category" for column in TEXT_COLUMNS if column in chunk.columns}))
+    data = {}
+    for column in chunks[0].columns:
+        if chunks[0][column].dtype.name == "category":
+            data[column] = union_categoricals([chunk[column] for chunk in chunks])
+        else:
+            data[column] = np.concatenate([chunk[column].to_numpy() for chunk in chunks])
+    return compact_crime_data(pd.DataFrame(data, columns = list(data)))
+
+def store_tag():
+    """
+    Returns a new suffix for the files of one write to a store. Files are never
+    rewritten under a name that a meta.json already gave to readers.
+    """
+    return "%x" % time.time_ns()
+
+def save_array(directory, name, values):
+    """
+    Writes an array to <name>.npy in the directory and returns the file name
+    """
+    np.save(os.path.join(directory, name + ".npy"), values)
+    return name + ".npy"
+
+def append_column(directory, file_name, length, values):
+    """
+    Writes values after the first length values of a raw column file, cutting
+    off what an interrupted append left behind them. Readers only map the rows
+    counted in their meta.json, so they see the new values once it counts them.
+    """
+    with open(os.path.join(directory, file_name), "ab") as column_file:
+        column_file.truncate(length * values.dtype.itemsize)
+        values.tofile(column_file)
+
+def store_files(meta):
+    """
+    Returns the names of the files of a store read by its meta.json
+    """
+    files = set(meta.get("files", {}).values())
+    files.update(column["file"] for column in meta.get("columns", {}).values() if "file" in column)
+    for segments in meta.get("postings", {}).values():
+        for segment in segments:
+            files.update(segment)
+    return files
+
+def save_meta(directory, meta):
+    """
+    Writes meta.json in one step, it is written last so a store without it is
+    incomplete and a changed meta.json tells workers to reload the store. The
+    files named by neither it nor the meta.json it replaces are then removed,
+    workers that just read the replaced one may still be opening its files.
+    """
+    path = os.path.join(directory, "meta.json")
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as meta_file:
+            previous = json.load(meta_file)
+    with replace_file(path) as meta_file:
+        json.dump(meta, meta_file)
+    kept = store_files(meta) | store_files(previous)
+    for name in os.listdir(directory):
+        if name.endswith((".npy", ".bin")) and name not in kept:
+            os.remove(os.path.join(directory, name))
+
+def read_store_meta(directory):
+    """
+    Reads the meta.json of a crime store, checking its version
+    """
+    with open(os.path.join(directory, "meta.json")) as meta_file:
+        meta = json.load(meta_file)
+    if meta["version"] != STORE_VERSION:
+        raise ValueError("Crime store %s has version %s, expected %s, rerun data_store.py"
+                         % (directory, meta["version"], STORE_VERSION))
+    return meta
+
+def crime_periods(df):
+    """
+    Returns the "YEAR-MONTH" keys of the months with crimes in the data
+    """
+    periods = df[["YEAR", "MONTH"]].drop_duplicates()
+    return ["%d-%02d" % (year, month) for year, month in zip(periods["YEAR"], periods["MONTH"])]
+
+def save_crime_store(df, directory):
+    """
+    Writes the wrangled crime data to a directory of column files that the app
+    can memory map at startup. String columns are stored as category codes and
+    integer columns at the smallest width that holds them. The crime cube and
+    the row index are stored alongside so they are not built on every worker
+    start. The files get new names, so workers that loaded the store before
+    keep reading the previous version until they reload it.
+
+    Parameters
+    ----------
+    df : Pandas Data Frame
+        crime data with the columns in CRIME_COLUMNS
+    directory : string
+        directory to write the store to
+    """
+    os.makedirs(directory, exist_ok = True)
+    df = compact_crime_data(df)
+    tag = store_tag()
+    columns = {}
+    for column in crime_columns(df):
+        if df[column].dtype.name == "category":
+            values = df[column].cat.codes.to_numpy()
+            columns[column] = {"dtype": values.dtype.name,
+                               "categories": df[column].cat.categories.tolist()}
+        else:
+            values = df[column].to_numpy()
+            columns[column] = {"dtype": values.dtype.name}
+        columns[column]["file"] = "%s.%s.bin" % (column, tag)
+        values.tofile(os.path.join(directory, columns[column]["file"]))
+    stored = map_crime_columns(directory, columns, len(df)).frame()
+    cube = build_cube(stored)
+    index = CrimeIndex(stored)
+    meta = {"version": STORE_VERSION,
+            "rows": len(df),
+            "columns": columns,
+            "cube": {dim: [None if pd.isna(label) else label for label in cube.categories[dim].tolist()]
+                     for dim in CUBE_DIMENSIONS},
+            "index": {column: segments[0][0].tolist() for column, segments in index.postings.items()},
+            "postings": {column: [save_postings(directory, column, tag, segments[0])]
+                         for column, segments in index.postings.items()},
+            # a new store invalidates every cached chart, appends only the months they touch
+            "created": time.time(),
+            "generation": 0,
+            "periods": {period: 0 for period in crime_periods(df)}}
+    save_aggregates(directory, meta, cube, tag)
+
+def part_values(path, dtype, length):
+    """
+    Memory maps the first length values of a column file written with tofile()
+    """
+    if length == 0:
+        return np.zeros(0, dtype = dtype)
+    return np.memmap(path, dtype = dtype, mode = "r", shape = (length,))
+
+def array_chunks(values, chunk_size):
+    """
+    Returns the (start, values) chunks of a memory mapped array, read into memory one at a time
+    """
+    for start in range(0, len(values), chunk_size):
+        yield start, np.array(values[start:start + chunk_size])
+
+def save_postings(directory, column, tag, postings):
+    """
+    Writes a postings segment of a column and returns its file names
+    """
+    labels, offsets, rows = postings
+    return [save_array(directory, "%s.offsets.%s" % (column, tag), offsets),
+            save_array(directory, "%s.rows.%s" % (column, tag), rows)]
+
+def save_postings_chunks(directory, column, tag, labels, code_chunks):
+    """
+    Writes the row index of a column from the codes of its values, chunk by
+    chunk, to the same files save_postings writes for build_postings
+
+    Parameters
+    ----------
+    directory : string
+        directory of the store
+    column : string
+        indexed column
+    tag : string
+        suffix of the file names
+    labels : Pandas Index
+        the values of the column, codes are positions in it and -1 is missing
+    code_chunks : function
+        returns the (start, codes) chunks of the column, called twice
+
+    Returns
+    -------
+    list
+        the names of the offsets and row ids files
+    """
+    counts = np.zeros(len(labels), dtype = np.int64)
+    for start, codes in code_chunks():
+        counts += np.bincount(codes[codes >= 0], minlength = len(labels))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    files = [save_array(directory, "%s.offsets.%s" % (column, tag), offsets)]
+    # next free position of every value, rows of later chunks follow earlier ones
+    cursor = offsets[:-1].copy()
+    def rows():
+        for start, codes in code_chunks():
+            order = np.flatnonzero(codes >= 0)
+            order = order[np.argsort(codes[order], kind = "stable")]
+            sorted_codes = codes[order]
+            chunk_counts = np.bincount(sorted_codes, minlength = len(labels))
+            group_starts = np.cumsum(chunk_counts) - chunk_counts
+            positions = cursor[sorted_codes] + np.arange(len(order)) - group_starts[sorted_codes]
+            cursor[:] += chunk_counts
+            yield positions, (order + start).astype(np.int32)
+    name = "%s.rows.%s" % (column, tag)
+    if offsets[-1] == 0:
+        return files + [save_array(directory, name, np.zeros(0, dtype = np.int32))]
+    values = np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode = "w+", dtype = np.int32,
+                                       shape = (int(offsets[-1]),))
+    for positions, row_ids in rows():
+        values[positions] = row_ids
+    values.flush()
+    del values
+    return files + [name + ".npy"]
+
+def stream_crime_store(path, directory, partial_months = PARTIAL_MONTHS, district_names = DISTRICT_NAMES,
+                       chunk_size = CHUNK_SIZE):
+    """
+    Writes the crime store of a crime csv of any size. The csv is read a chunk
+    at a time into raw column files, then the columns, the crime cube and the
+    row index are written chunk by chunk, so memory use depends on chunk_size
+    and not on the size of the csv. The store is the one save_crime_store
+    writes for the same data.
+
+    Parameters
+    ----------
+    path : string
+        location of crime.csv
+    directory : string
+        directory to write the store to
+    partial_months : list
+        incomplete months of the csv to drop as 'YYYY-MM'
+    district_names : dictionary
+        neighbourhood name of every police district code
+    chunk_size : int
+        rows read and aggregated at a time
+
+    Returns
+    -------
+    int
+        the number of crime records stored
+    """
+    os.makedirs(directory, exist_ok = True)
+    tag = store_tag()
+    rows = 0
+    parts = {}
+    # ids of the text values in the order they are first seen, and the integer values seen
+    text_ids = {}
+    seen = {}
+    periods = {}
+    for chunk in read_crime_chunks(path, partial_months = partial_months,
+                                   district_names = district_names, chunk_size = chunk_size):
+        for column in crime_columns(chunk):
+            if column in INTEGER_DTYPES:
+                values = chunk[column].to_numpy().astype(INTEGER_DTYPES[column])
+                seen.setdefault(column, set()).update(np.unique(values).tolist())
+            else:
+                ids = text_ids.setdefault(column, {})
+                codes, uniques = pd.factorize(chunk[column])
+                uniques = np.array([ids.setdefault(label, len(ids)) for label in uniques] + [-1], dtype = np.int32)
+                values = uniques[codes]
+            if column not in parts:
+                parts[column] = open(os.path.join(directory, column + ".part"), "wb")
+            values.tofile(parts[column])
+        periods.update(dict.fromkeys(crime_periods(chunk)))
+        rows += len(chunk)
+    for part in parts.values():
+        part.close()
+
+    columns = {}
+    missing = {}
+    for column in parts:
+        part_path = os.path.join(directory, column + ".part")
+        file_name = "%s.%s.bin" % (column, tag)
+        if column in INTEGER_DTYPES:
+            # the raw values already are the column file
+            columns[column] = {"dtype": np.dtype(INTEGER_DTYPES[column]).name, "file": file_name}
+            os.replace(part_path, os.path.join(directory, file_name))
+        else:
+            if column == "DAY_OF_WEEK":
+                categories = DAYS_OF_WEEK
+            else:
+                categories = sorted(text_ids[column])
+            positions = {label: position for position, label in enumerate(categories)}
+            # stored code of every id, values outside the categories are missing
+            recode = np.array([positions.get(label, -1) for label in text_ids[column]] + [-1])
+            dtype = np.dtype(next(code_dtype for code_dtype in CODE_DTYPES
+                                  if len(categories) < np.iinfo(code_dtype).max))
+            columns[column] = {"dtype": dtype.name, "categories": list(categories), "file": file_name}
+            missing[column] = False
+            with open(os.path.join(directory, file_name), "wb") as column_file:
+                for start, ids in array_chunks(part_values(part_path, np.int32, rows), chunk_size):
+                    codes = recode[ids].astype(dtype)
+                    missing[column] = missing[column] or bool((codes < 0).any())
+                    codes.tofile(column_file)
+            os.remove(part_path)
+
+    # crime cube with the axes of all the records, the counts of every chunk are added to it
+    categories = {}
+    for dim in CUBE_DIMENSIONS:
+        if "categories" in columns[dim]:
+            labels = pd.Index(columns[dim]["categories"])
+            if missing[dim]:
+                labels = labels.append(pd.Index([np.nan]))
+        else:
+            labels = pd.Index(sorted(seen[dim]))
+        categories[dim] = labels
+    shape = tuple(len(categories[dim]) for dim in CUBE_DIMENSIONS)
+    daily, first_day, day_counts = None, None, None
+    if DATE_COLUMN in columns and rows > 0:
+        first_day = min(seen[DATE_COLUMN])
+        daily = np.zeros((max(seen[DATE_COLUMN]) - first_day + 1,) + shape[2:4], dtype = np.uint32)
+        # crimes per day, neighbourhood, crime and hour of every chunk, summed up over time once at the end
+        day_counts = day_count_array(len(daily), shape[2:4] + shape[5:])
+    cube = CrimeCube(np.zeros(shape, dtype = np.uint32), categories, daily = daily, first_day = first_day)
+    for start in range(0, rows, chunk_size):
+        chunk = map_crime_columns(directory, columns, rows).frame(slice(start, start + chunk_size))
+        cube = merge_cubes(cube, build_cube(chunk, cumulative = False), cumulative = False)
+        if day_counts is not None:
+            add_day_counts(day_counts, chunk[DATE_COLUMN].to_numpy().astype(np.int64) - first_day,
+                           *[axis_codes(chunk[dim], categories[dim])
+                             for dim in ["DISTRICT", "OFFENSE_CODE_GROUP", "HOUR"]])
+    if day_counts is not None:
+        cube.cumulative = cumulate_days(day_counts, cumulative_dtype(cube.counts))
+
+    index = {}
+    postings = {}
+    for column in INDEXED_COLUMNS:
+        if "categories" in columns[column]:
+            labels = pd.Index(columns[column]["categories"])
+            lookup = None
+        else:
+            labels = pd.Index(sorted(seen[column]))
+            lookup = labels.to_numpy()
+        def code_chunks():
+            stored = part_values(os.path.join(directory, columns[column]["file"]), columns[column]["dtype"], rows)
+            for start, values in array_chunks(stored, chunk_size):
+                yield start, values.astype(np.int64) if lookup is None else np.searchsorted(lookup, values)
+        postings[column] = [save_postings_chunks(directory, column, tag, labels, code_chunks)]
+        index[column] = labels.tolist()
+
+    meta = {"version": STORE_VERSION,
+            "rows": rows,
+            "columns": columns,
+            "cube": {dim: [None if pd.isna(label) else label for label in cube.categories[dim].tolist()]
+                     for dim in CUBE_DIMENSIONS},
+            "index": index,
+            "postings": postings,
+            "created": time.time(),
+            "generation": 0,
+            "periods": {period: 0 for period in periods}}
+    save_aggregates(directory, meta, cube, tag)
+    return rows
+
+def save_aggregates(directory, meta, cube, tag):
+    """
+    Writes the crime cube of a store followed by its meta.json
+    """
+    meta["files"] = {"cube": save_array(directory, "cube." + tag, cube.counts),
+                     "rollup": save_array(directory, "rollup." + tag, cube.rollup)}
+    if cube.daily is not None:
+        meta["files"]["daily"] = save_array(directory, "daily." + tag, cube.daily)
+        meta["files"]["cumulative"] = save_array(directory, "cumulative." + tag, cube.cumulative)
+    meta["first_day"] = cube.first_day
+    save_meta(directory, meta)
+
+def append_crime_store(df, directory):
+    """
+    Appends new crime records to a crime store. The new rows are written
+    after the stored ones in the column files, their counts are added to the
+    stored cube and their row ids get a postings segment of their own, so the
+    stored records are neither read nor written again. The newest segments are
+    merged while the one before them is at most twice as large, so every
+    segment is more than twice the size of the next one and a store holds a
+    logarithmic number of them. Records with a neighbourhood, crime or year that is not in
+    the store rebuild it. Only the months of the new records get a new
+    generation, so the app keeps the cached charts of the other months.
+
+    Parameters
+    ----------
+    df : Pandas Data Frame
+        new crime data with the columns in CRIME_COLUMNS, and DATE when the
+        store has it
+    directory : string
+        directory of the store
+
+    Returns
+    -------
+    list
+        the "YEAR-MONTH" keys of the months that changed
+    """
+    with open(os.path.join(directory, "append.lock"), "w") as lock_file:
+        # one append at a time, readers are never blocked
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        meta = read_store_meta(directory)
+        stored, cube, index = load_crime_store(directory, meta = meta)
+        columns = list(meta["columns"])
+        if not set(columns) <= set(df.columns):
+            raise ValueError("New crime records need the columns %s" % columns)
+        added = pd.DataFrame({column: df[column] for column in columns}, index = df.index)
+        new_values = False
+        for column in columns:
+            if "categories" in meta["columns"][column]:
+                values = added[column].astype(object)
+                added[column] = pd.Categorical(values, categories = meta["columns"][column]["categories"])
+                new_values = new_values or added[column].notna().sum() < values.notna().sum()
+            else:
+                added[column] = added[column].to_numpy().astype(INTEGER_DTYPES[column])
+        merged = None if new_values else merge_cubes(cube, build_cube(added))
+        periods = crime_periods(added)
+        if merged is None:
+            records = pd.concat([stored.frame().astype(object), df[columns].astype(object)], ignore_index = True)
+            save_crime_store(records, directory)
+            return periods
+        tag = store_tag()
+        for column in columns:
+            if "categories" in meta["columns"][column]:
+                values = added[column].cat.codes.to_numpy()
+            else:
+                values = added[column].to_numpy()
+            append_column(directory, meta["columns"][column]["file"], len(stored),
+                          values.astype(meta["columns"][column]["dtype"]))
+        for column in INDEXED_COLUMNS:
+            segments = index.postings[column]
+            segments = segments + [segment_postings(segments[0][0], build_postings(added[column]), len(stored))]
+            files = meta["postings"][column] + [None]
+            while len(segments) > 1 and len(segments[-2][2]) <= 2 * len(segments[-1][2]):
+                segments[-2:] = [merge_postings(segments[-2:])]
+                files[-2:] = [None]
+            files[-1] = save_postings(directory, column, tag, segments[-1])
+            meta["postings"][column] = files
+        meta["rows"] = len(stored) + len(added)
+        meta["generation"] += 1
+        for period in periods:
+            meta["periods"][period] = meta["generation"]
+        save_aggregates(directory, meta, merged, tag)
+        return periods
+
+def store_data_version(meta, year = None, month = None):
+    """
+    Returns the version of the stored crimes in the selected years and months,
+    it only changes when new records are appended to those months
+
+    Parameters
+    ----------
+    meta : dictionary
+        meta.json of the store
+    year : int or list
+        year or range of years selected
+    month : int or list
+        month or range of months selected
+
+    Returns
+    -------
+    tuple
+        the creation time of the store and the generation of the latest
+        append touching the selection
+    """
+    def within(value, span):
+        if span is None:
+            return True
+        if type(span) == list:
+            return span[0] <= value <= span[1]
+        return value == span
+
+    generation = 0
+    for period, period_generation in meta["periods"].items():
+        period_year, period_month = period.split("-")
+        if within(int(period_year), year) and within(int(period_month), month):
+            generation = max(generation, period_generation)
+    return (meta["created"], generation)
+
+class CrimeColumns:
+    """
+    Memory mapped columns of a crime store. A data frame of them would copy the
+    columns of one dtype into a single block in memory, so the columns stay
+    mapped arrays and only the rows a chart selects become a data frame.
+    """
+    def __init__(self, arrays, categories):
+        self.arrays = arrays
+        self.categories = categories
+        self.columns = list(arrays)
+
+    def __len__(self):
+        return len(self.arrays[self.columns[0]]) if self.columns else 0
+
+    def __getitem__(self, column):
+        """
+        Returns a column as a series backed by its file
+        """
+        return pd.Series(self.values(column), name = column, copy = False)
+
+    def values(self, column, rows = slice(None)):
+        """
+        Returns the values of a column in the given rows, the text columns as
+        categoricals of their codes
+        """
+        values = self.arrays[column][rows]
+        if column in self.categories:
+            return pd.Categorical.from_codes(values, categories = self.categories[column])
+        return values
+
+    def frame(self, rows = slice(None)):
+        """
+        Returns a data frame of the given slice or row ids, indexed by row id
+        """
+        return pd.DataFrame({column: self.values(column, rows) for column in self.columns},
+                            columns = self.columns, index = pd.RangeIndex(len(self))[rows])
+
+    def memory_usage(self, index = False, deep = True):
+        """
+        Returns the bytes mapped for every column
+        """
+        return pd.Series({column: self.arrays[column].nbytes for column in self.columns}, dtype = np.int64)
+
+def map_crime_columns(directory, columns, length):
+    """
+    Memory maps the first length rows of the column files of a crime store
+    """
+    return CrimeColumns({column: part_values(os.path.join(directory, columns[column]["file"]),
+                                             columns[column]["dtype"], length)
+                         for column in columns},
+                        {column: columns[column]["categories"] for column in columns
+                         if "categories" in columns[column]})
+
+def load_crime_store(directory, meta = None):
+    """
+    Loads a crime store written by save_crime_store
+
+    Parameters
+    ----------
+    directory : string
+        directory of the store
+    meta : dictionary
+        meta.json of the store if it was already read
+
+    Returns
+    -------
+    tuple
+        the CrimeColumns of the crime data, the crime cube and the row index
+    """
+    if meta is None:
+        meta = read_store_meta(directory)
+    # every file is read under the name meta.json gives it, so a store that
+    # is appended to or rebuilt meanwhile is never read half old and half new
+    def stored(file_name):
+        return np.load(os.path.join(directory, file_name), mmap_mode = "r")
+
+    df = map_crime_columns(directory, meta["columns"], meta["rows"])
+    categories = {dim: pd.Index([np.nan if label is None else label for label in labels])
+                  for dim, labels in meta["cube"].items()}
+    daily, cumulative = None, None
+    if meta["first_day"] is not None:
+        daily = stored(meta["files"]["daily"])
+        cumulative = stored(meta["files"]["cumulative"])
+    cube = CrimeCube(stored(meta["files"]["cube"]),
+                     categories,
+                     rollup = stored(meta["files"]["rollup"]),
+                     daily = daily,
+                     first_day = meta["first_day"],
+                     cumulative = cumulative)
+    postings = {column: [(pd.Index(meta["index"][column]), stored(offsets), stored(rows))
+                         for offsets, rows in meta["postings"][column]]
+                for column in INDEXED_COLUMNS}
+    return df, cube, CrimeIndex(df, postings = postings)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Converts crime.csv into the columnar store loaded by the app")
+    parser.add_argument("csv", nargs = "?", help = "location of crime.csv (default data/crime.csv)")
+    parser.add_argument("store", nargs = "?", help = "directory to write the store to (default data/crime_store)")
+    parser.add_argument("--append", action = "store_true",
+                        help = "append the records of the csv to the store instead of replacing it")
+    parser.add_argument("--dataset", help = "use the csv, store and district names of this dataset of the registry "
+                                            "named by DATASETS (default datasets.json)")
+    parser.add_argument("--chunk-size", type = int, default = CHUNK_SIZE,
+                        help = "rows of the csv read at a time, memory use grows with it")
+    args = parser.parse_args()
+    config = {"crime_csv": "data/crime.csv", "crime_store": "data/crime_store", "district_names": DISTRICT_NAMES,
+              "partial_months": PARTIAL_MONTHS}
+    if args.dataset:
+        from datasets import read_registry
+        config = read_registry(os.environ.get("DATASETS", "datasets.json"))[args.dataset]
+    csv = args.csv or config["crime_csv"]
+    store = args.store or config.get("crime_store")
+    if store is None:
+        parser.error("dataset %s has no crime_store" % args.dataset)
+    district_names = config.get("district_names", {})
+    if args.append:
+        periods = append_crime_store(read_crime_csv(csv, partial_months = [], district_names = district_names,
+                                                    chunk_size = args.chunk_size), store)
+        print("Updated %s" % ", ".join(sorted(periods)))
+    else:
+        rows = stream_crime_store(csv, store, partial_months = config.get("partial_months", []),
+                                  district_names = district_names, chunk_size = args.chunk_size)
+        print("Stored %d crime records in %s" % (rows, store))
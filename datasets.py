@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from data_store import DISTRICT_NAMES, PARTIAL_MONTHS
+
+# the city served when no registry file exists
+DEFAULT_DATASETS = {"boston": {"title": "Boston",
+                               "crime_csv": "data/crime.csv",
+                               "crime_store": "data/crime_store",
+                               "geojson": "data/Boston_Neighborhoods.geojson",
+                               "district_names": DISTRICT_NAMES,
+                               "partial_months": PARTIAL_MONTHS}}
+
+## FUNCTIONS
+def read_registry(path):
+    """
+    Reads the datasets served by the app
+
+    Parameters
+    ----------
+    path : string
+        JSON file mapping every dataset id to its title, crime_csv, crime_store,
+        geojson, district_names and the incomplete partial_months of its csv,
+        the first dataset is shown when the page opens
+
+    Returns
+    -------
+    dictionary
+        the configuration of every dataset by id, DEFAULT_DATASETS when there
+        is no registry file
+    """
+    if not os.path.exists(path):
+        return DEFAULT_DATASETS
+    with open(path) as registry_file:
+        configs = json.load(registry_file, object_pairs_hook = OrderedDict)
+    for dataset_id, config in configs.items():
+        missing = [field for field in ["crime_csv", "geojson"] if field not in config]
+        if missing:
+            raise ValueError("Dataset %r in %s has no %s" % (dataset_id, path, ", ".join(missing)))
+    return configs
+
+def array_bytes(values):
+    """
+    Returns the bytes held by an array, a categorical or a data frame
+    """
+    if values is None:
+        return 0
+    if hasattr(values, "memory_usage"):
+        return int(values.memory_usage(index = False, deep = True).sum())
+    if hasattr(values, "codes"):
+        return int(values.codes.nbytes + values.categories.memory_usage(deep = True))
+    return int(np.asarray(values).nbytes)
+
+class Dataset:
+    """
+    Crime data, neighbourhood geometry and filter options of one city. The
+    crime store is memory mapped, a dataset without one reads its csv instead.
+    A loaded dataset is never changed, records appended to its store are
+    loaded into a new dataset so a request reads one version of the crimes.
+    """
+    def __init__(self, dataset_id, config):
+        self.id = dataset_id
+        self.config = config
+        self.title = config.get("title", dataset_id)
+        self.store_dir = config.get("crime_store")
+        self.meta = None
+        self.times = {}
+
+    def load(self, tolerance = 0.0001, precision = 5, aggregate_cache = None):
+        """
+        Loads the geometry and the crime data of the dataset, timing every
+        phase in times
+
+        Parameters
+        ----------
+        tolerance : float
+            simplification tolerance of the neighbourhood polygons in degrees
+        precision : int
+            decimals kept in the polygon coordinates
+        aggregate_cache : RenderCache or DiskCache
+            cache sharing the crime cube of a csv between workers, None builds it
+        """
+        from helpers import get_gpd_df, serialize_geo_features
+        from aggregates import build_cube
+        from data_store import read_crime_csv
+        from row_index import CrimeIndex
+
+        began = time.perf_counter()
+        self.gdf = get_gpd_df(self.config["geojson"])
+        # simplify and serialize the neighbourhood geometry once for every choropleth
+        self.geo_features, self.geo_fragments = serialize_geo_features(self.gdf, tolerance = tolerance,
+                                                                       precision = precision)
+        self.times['geometry'] = round(time.perf_counter() - began, 3)
+
+        began = time.perf_counter()
+        # prefer the columnar store written by data_store.py
+        if self.store_dir and os.path.exists(os.path.join(self.store_dir, 'meta.json')):
+            self.load_store()
+            self.times['crime store'] = round(time.perf_counter() - began, 3)
+        else:
+            crime_file = os.stat(self.config["crime_csv"])
+            # cached entries are only valid for this version of the crime data
+            self.data_version = (crime_file.st_size, crime_file.st_mtime)
+            self.df = read_crime_csv(self.config["crime_csv"],
+                                     partial_months = self.config.get("partial_months", []),
+                                     district_names = self.config.get("district_names", {}))
+            self.times['crime csv'] = round(time.perf_counter() - began, 3)
+            began = time.perf_counter()
+            # pre-aggregate the counts once so the callbacks never rescan the crime records
+            if aggregate_cache is not None:
+                # the first worker to load the dataset builds the cube, the others read it
+                self.cube = aggregate_cache.get_or_render(('cube', 'cumulative', self.id) + self.data_version,
+                                                          lambda: build_cube(self.df))
+            else:
+                self.cube = build_cube(self.df)
+            # row ids of every year, month, neighbourhood and crime
+            self.crime_index = CrimeIndex(self.df)
+            self.times['aggregates'] = round(time.perf_counter() - began, 3)
+
+        began = time.perf_counter()
+        self.update_filters()
+        self.times['filters'] = round(time.perf_counter() - began, 3)
+
+    def update_filters(self):
+        """
+        Lists the years, crimes and neighbourhoods offered by the filters, read
+        from the cube so the crime records are not scanned
+        """
+        categories, rollup = self.cube.categories, self.cube.rollup
+        crimes = categories['OFFENSE_CODE_GROUP'][rollup.sum(axis = (0, 1, 2)) > 0]
+        self.crime_list = sorted(x for x in crimes if str(x) != 'nan')
+        neighbourhoods = categories['DISTRICT'][rollup.sum(axis = (0, 1, 3)) > 0]
+        self.neighbourhood_list = sorted(x for x in neighbourhoods if str(x) != 'nan')
+        years = self.cube.categories['YEAR']
+        self.year_range = [int(min(years)), int(max(years))]
+        # weekly and daily trends and date ranges need the day of every crime
+        self.trend_granularities = [('Month', 'month')]
+        self.date_range = None
+        if self.cube.daily is not None:
+            self.trend_granularities += [('Week', 'week'), ('Day', 'day')]
+            self.date_range = [self.cube.first_day, self.cube.first_day + len(self.cube.daily) - 1]
+
+    def load_store(self):
+        """
+        Memory maps the crime store along with its cube and row index
+        """
+        from data_store import load_crime_store, read_store_meta
+        # a changed meta.json means records were appended with data_store.py --append,
+        # its time is read first so an append meanwhile is loaded by the next request
+        self.store_mtime = os.stat(os.path.join(self.store_dir, 'meta.json')).st_mtime_ns
+        self.meta = read_store_meta(self.store_dir)
+        self.df, self.cube, self.crime_index = load_crime_store(self.store_dir, meta = self.meta)
+
+    def stale(self):
+        """
+        Returns whether records were appended to the crime store since it was loaded
+        """
+        if self.meta is None:
+            return False
+        return os.stat(os.path.join(self.store_dir, 'meta.json')).st_mtime_ns != self.store_mtime
+
+    def reload(self):
+        """
+        Returns a new dataset of the crime store as it is now, sharing the
+        geometry of this one, which is left as it is for the requests using it.
+        The column files are memory mapped and the filters are read from the
+        cube, so reloading reads no records.
+        """
+        began = time.perf_counter()
+        dataset = Dataset(self.id, self.config)
+        dataset.gdf, dataset.geo_features, dataset.geo_fragments = self.gdf, self.geo_features, self.geo_fragments
+        dataset.load_store()
+        dataset.update_filters()
+        dataset.times = dict(self.times, **{'crime store': round(time.perf_counter() - began, 3)})
+        return dataset
+
+    def version(self, year_value, month_value = None):
+        """
+        Returns the version of the crime data shown for the selected years and
+        months, an append only changes it for the months it touched
+        """
+        if self.meta is None:
+            return self.data_version
+        from data_store import store_data_version
+        return store_data_version(self.meta, year = year_value, month = month_value)
+
+    def nbytes(self):
+        """
+        Returns the bytes held by the crime data, its aggregates and geometry,
+        memory mapped files included as the charts read them into the page cache
+        """
+        total = array_bytes(self.df) + array_bytes(self.gdf.drop(columns = 'geometry'))
+        total += sum(array_bytes(values) for values in [self.cube.counts, self.cube.rollup, self.cube.daily,
+                                                             self.cube.cumulative])
+        total += sum(array_bytes(offsets) + array_bytes(rows)
+                     for segments in self.crime_index.postings.values() for values, offsets, rows in segments)
+        total += sum(len(geometry) for geometry in self.geo_fragments.values())
+        return total
+
+class DatasetRegistry:
+    """
+    Datasets of every city served by the app, loaded on first access. Once the
+    loaded datasets hold more than memory_budget bytes the least recently used
+    ones are dropped, requests still using them keep their reference. A
+    dataset whose crime store was appended to is replaced by a reloaded one.
+    """
+    def __init__(self, configs, memory_budget = 1024 * 1024 * 1024, **load_options):
+        self.configs = configs
+        self.memory_budget = memory_budget
+        self.load_options = load_options
+        self.datasets = OrderedDict()
+        self.sizes = {}
+        self.loading = {dataset_id: threading.Lock() for dataset_id in configs}
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def ids(self):
+        return list(self.configs)
+
+    def default_id(self):
+        return self.ids()[0]
+
+    def get(self, dataset_id = None):
+        """
+        Returns a loaded dataset, loading it and evicting idle datasets first
+        if needed. Requests for a dataset that is loading wait for it, a
+        dataset is (re)loaded by one request at a time and published whole.
+        """
+        if dataset_id is None:
+            dataset_id = self.default_id()
+        if dataset_id not in self.configs:
+            raise KeyError("Unknown dataset %r" % dataset_id)
+        with self.lock:
+            dataset = self.datasets.get(dataset_id)
+            if dataset is not None:
+                self.datasets.move_to_end(dataset_id)
+        if dataset is not None and not dataset.stale():
+            return dataset
+        with self.loading[dataset_id]:
+            with self.lock:
+                dataset = self.datasets.get(dataset_id)
+            if dataset is None:
+                dataset = Dataset(dataset_id, self.configs[dataset_id])
+                dataset.load(**self.load_options)
+            elif dataset.stale():
+                dataset = dataset.reload()
+            else:
+                # reloaded by the request this one waited for
+                return dataset
+            with self.lock:
+                self.datasets[dataset_id] = dataset
+                self.sizes[dataset_id] = dataset.nbytes()
+                self.evict(keep = dataset_id)
+            return dataset
+
+    def evict(self, keep):
+        """
+        Drops the least recently used datasets other than keep until the loaded
+        ones fit the memory budget, called with the lock held
+        """
+        for dataset_id in list(self.datasets):
+            if sum(self.sizes.values()) <= self.memory_budget:
+                break
+            if dataset_id != keep:
+                del self.datasets[dataset_id]
+                del self.sizes[dataset_id]
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {"loaded": list(self.datasets),
+                    "bytes": dict(self.sizes),
+                    "memory_budget": self.memory_budget,
+                    "evictions": self.evictions}
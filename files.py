@@ -0,0 +1,27 @@
+import os
+import threading
+from contextlib import contextmanager
+
+## FUNCTIONS
+@contextmanager
+def replace_file(path, mode = "w"):
+    """
+    Opens a temporary file next to path and moves it over path in one step once
+    it is written, so readers see the old or the new file and never a partial
+    one. The temporary file is removed when writing it fails.
+
+    Parameters
+    ----------
+    path : string
+        file to write
+    mode : string
+        mode the temporary file is opened with, "w" or "wb"
+    """
+    temporary = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary, mode) as new_file:
+            yield new_file
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
@@ -1,9 +1,16 @@
 import altair as alt
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import json
+from shapely.geometry import mapping
+from aggregates import CrimeCube
+from row_index import CrimeIndex
+from metrics import chart_metrics
+from chart_templates import fill_template
+from chart_data import fragment_placeholder
 ## FUNCTIONS
-def chart_filter(df, year = None, month = None, neighbourhood = None, crime = None):
+def chart_filter(df, year = None, month = None, neighbourhood = None, crime = None, date = None):
     """
     Filters the given database in order to wrange the database into the proper dataframe 
     required the graphs to display relevant information. Default value of None will allow 
@@ -12,8 +19,8 @@ def chart_filter(df, year = None, month = None, neighbourhood = None, crime = No
     
     Parameters
     ----------
-    df : Pandas Data Frame
-        Dataframe of crime data
+    df : Pandas Data Frame, CrimeCube or CrimeIndex
+        Dataframe of crime data, the pre-aggregated crime cube or the indexed crime data
     year : int or list 
         year or years of crime committed to be displayed in the graphs
     month : int or list 
@@ -22,40 +29,68 @@ def chart_filter(df, year = None, month = None, neighbourhood = None, crime = No
         neighbourhood or neighbourhoods of where crime occurs 
     crime : string or list 
         crime or crimes commited to be displayed
+    date : int or list
+        day or range of days of crime committed, in days since 1970-01-01
 
     Returns
     -------
-    Pandas Data Frame
+    Pandas Data Frame or CrimeCube
         A filtered data frame or relevant information 
     """
-    filtered_df = df
-    if year != None:
-        if type(year) == list:
-            year_list = list(range(year[0], year[1]+1))
-            filtered_df = filtered_df.query('YEAR == %s' % year_list)
-        else:
-            filtered_df = filtered_df.query('YEAR == %s' % year)
-    if month != None:
-        if type(month) == list:
-            month_list = list(range(month[0], month[1]+1))
-            filtered_df = filtered_df.query('MONTH == %s' % month_list)
-        else:
-            filtered_df = filtered_df.query('MONTH == %s' % month)
-    if neighbourhood != None:
-        if neighbourhood == []:
-            neighbourhood = None
-        elif type(neighbourhood) == list:
-            filtered_df = filtered_df.query('DISTRICT == %s' % neighbourhood)
-        else:
-            filtered_df = filtered_df.query('DISTRICT == "%s"' % neighbourhood)
-    if crime != None:
-        if crime == []:
-            crime = None
-        elif type(crime) == list:
-            filtered_df = filtered_df.query('OFFENSE_CODE_GROUP == %s' % crime)
-        else:
-            filtered_df = filtered_df.query('OFFENSE_CODE_GROUP == "%s"' % crime)       
-    return filtered_df
+    if isinstance(df, (CrimeCube, CrimeIndex)):
+        return df.filter(year = year, month = month, neighbourhood = neighbourhood, crime = crime, date = date)
+    mask = None
+    filters = [('YEAR', year, True),
+               ('MONTH', month, True),
+               ('DISTRICT', neighbourhood, False),
+               ('OFFENSE_CODE_GROUP', crime, False),
+               ('DATE', date, True)]
+    for column, value, is_range in filters:
+        if value is None or (value == [] and not is_range):
+            continue
+        column_mask = value_mask(df[column], value, is_range = is_range)
+        mask = column_mask if mask is None else mask & column_mask
+    if mask is None:
+        return df
+    # a single take once every filter is combined
+    return df[mask]
+
+def value_mask(series, value, is_range = False):
+    """
+    Creates the boolean mask of the rows of a column matching a chart_filter 
+    value. Categorical columns are compared through their integer codes and 
+    integer ranges through their bounds so no strings are compared per row. 
+    
+    Parameters
+    ----------
+    series : Pandas Series
+        column of the crime data
+    value : int, string or list 
+        value or values to keep, a list of two values is a range when is_range is True
+    is_range : boolean
+        whether a list value gives the first and last value of a range
+
+    Returns
+    -------
+    numpy array
+        boolean mask of the matching rows
+    """
+    if type(value) == list:
+        if is_range:
+            if series.dtype.kind in 'iu':
+                values = series.to_numpy()
+                return (values >= value[0]) & (values <= value[1])
+            value = list(range(value[0], value[1]+1))
+    else:
+        value = [value]
+    if series.dtype.name == 'category':
+        # look the codes up in a table of the selected categories, the extra
+        # last slot is hit by the -1 code of missing values
+        positions = series.cat.categories.get_indexer(value)
+        selected = np.zeros(len(series.cat.categories) + 1, dtype = bool)
+        selected[positions[positions >= 0]] = True
+        return selected[series.cat.codes.to_numpy()]
+    return series.isin(value).to_numpy()
 
 def year_filter(year = None):
     """
@@ -77,38 +112,75 @@ def year_filter(year = None):
         single_year = False
     return single_year
 
+def date_days(date = None):
+    """
+    Converts a date picked in the dashboard to days since 1970-01-01
+
+    Parameters
+    ----------
+    date : string
+        date as 'YYYY-MM-DD', optionally followed by a time
+
+    Returns
+    -------
+    int
+        the day of the date, None when no date is picked
+    """
+    if date is None:
+        return None
+    return int((pd.Timestamp(date[:10]) - pd.Timestamp(0)).days)
+
+def day_date(day):
+    """
+    Converts days since 1970-01-01 to a 'YYYY-MM-DD' date for the date picker
+    """
+    return str(np.datetime64(int(day), 'D'))
+
 
 def create_merged_gdf(df, gdf, neighbourhood):
     """
     Use the filtered dataframe to create the map 
-    create the geo pandas merged dataframe  
+    create the geo pandas merged dataframe holding the crime count of each 
+    neighbourhood in the YEAR column, neighbourhoods outside the selection 
+    get a missing count 
     
     Parameters
     ----------
-    df : Pandas dataframe
+    df : Pandas dataframe or CrimeCube
         filtered dataframe
     gdf : Geo Pandas dataframe
-        geopandas data frame 
-    neighbourhood : list 
+        geopandas data frame, indexed by neighbourhood Name as returned by 
+        get_gpd_df() to reuse its lookup between calls
+    neighbourhood : string or list 
         selected neighbourhood to be displayed
 
     Returns
     -------
-    boolean
-        whether the inputed year is a single value - True 
+    Geo Pandas dataframe
+        the neighbourhoods with crimes and their crime count
     """
-    df = df.groupby(by = 'DISTRICT').agg("count")
-    if neighbourhood != []:
-        if neighbourhood != None:
-            neighbourhood = list(neighbourhood)
-            for index_label, row_series in df.iterrows():
-            # For each row update the 'Bonus' value to it's double
-                if index_label not in neighbourhood:
-                    df.at[index_label , 'YEAR'] = None
-    gdf = gdf.merge(df, left_on='Name', right_on='DISTRICT', how='inner')
+    if isinstance(df, CrimeCube):
+        counts = df.count('DISTRICT')
+    else:
+        # observed keeps categorical districts without crimes off the map
+        counts = df.groupby(by = 'DISTRICT', observed = True).size()
+    if neighbourhood != None and neighbourhood != []:
+        if type(neighbourhood) != list:
+            neighbourhood = [neighbourhood]
+        counts = counts.where(counts.index.isin(neighbourhood))
+    if gdf.index.name == 'Name':
+        names = gdf.index
+    else:
+        names = pd.Index(gdf['Name'])
+    # polygon rows of the districts with crimes, in the order of the polygons
+    positions = names.get_indexer(counts.index)
+    found = positions >= 0
+    order = np.argsort(positions[found])
+    gdf = gdf.iloc[positions[found][order]].reset_index(drop = True)
+    gdf['YEAR'] = counts.to_numpy()[found][order]
     return gdf
 
-def create_geo_data(gdf):
+def create_geo_data(gdf, features = None):
     """
     Creates the altair data given the geo data frame 
     
@@ -116,15 +188,67 @@ def create_geo_data(gdf):
     ----------
     gdf : Geo Pandas dataframe
         geopandas data frame 
+    features : dictionary
+        geometry placeholders by neighbourhood Name from serialize_geo_features(), 
+        when given only the Name and YEAR count of gdf are joined onto them
 
     Returns
     -------
     dataframe 
         returns the necessary dataframe needed to render in altair 
     """
-    choro_json = json.loads(gdf.to_json())
-    choro_data = alt.Data(values = choro_json['features'])
-    return choro_data
+    if features is None:
+        choro_json = json.loads(gdf.to_json())
+        return alt.Data(values = choro_json['features'])
+    values = []
+    for name, count in zip(gdf['Name'], gdf['YEAR'].tolist()):
+        values.append({"type": "Feature",
+                       "geometry": features[name],
+                       "properties": {"Name": name, "YEAR": None if pd.isna(count) else count}})
+    return alt.Data(values = values)
+
+def round_coordinates(coordinates, precision):
+    """
+    Rounds nested GeoJSON coordinates to the given number of decimals 
+    """
+    if isinstance(coordinates, (list, tuple)):
+        return [round_coordinates(part, precision) for part in coordinates]
+    return round(coordinates, precision)
+
+def serialize_geo_features(gdf, tolerance = 0.0001, precision = 5):
+    """
+    Simplifies the neighbourhood polygons once and serializes their geometry 
+    to JSON, so each choropleth only joins the crime counts onto placeholders 
+    that are replaced by the serialized geometry with splice_fragments() 
+    
+    Parameters
+    ----------
+    gdf : Geo Pandas dataframe
+        geopandas data frame of the neighbourhoods
+    tolerance : float
+        simplification tolerance in degrees, 0 keeps the full geometry
+    precision : int
+        decimals kept in the coordinates, None keeps them all
+
+    Returns
+    -------
+    tuple
+        the geometry placeholder of each neighbourhood Name and the GeoJSON 
+        geometry of each placeholder
+    """
+    features = {}
+    fragments = {}
+    for name, geometry in zip(gdf['Name'], gdf.geometry):
+        if tolerance:
+            geometry = geometry.simplify(tolerance, preserve_topology = True)
+        geometry = mapping(geometry)
+        if precision is not None:
+            geometry = {"type": geometry["type"],
+                        "coordinates": round_coordinates(geometry["coordinates"], precision)}
+        geometry_json = json.dumps(geometry, separators = (",", ":"))
+        features[name] = fragment_placeholder(geometry_json)
+        fragments[features[name]] = geometry_json
+    return features, fragments
 
 def gen_map(geodata, color_column, title, tooltip):
     """
@@ -171,6 +295,41 @@ def gen_map(geodata, color_column, title, tooltip):
     return base + choro
 
 # create plot functions
+def count_crimes(df, by):
+    """
+    Counts the crimes by the given columns in pandas, so charts receive one 
+    row per group instead of every crime record 
+    
+    Parameters
+    ----------
+    df : Pandas Data Frame or CrimeCube
+        filtered crime data
+    by : list
+        columns to count the crimes by
+
+    Returns
+    -------
+    Pandas Data Frame
+        the by columns and the crime count n of every non empty group, sorted 
+        by the by columns
+    """
+    if isinstance(df, CrimeCube):
+        counts = df.count(by)
+    else:
+        counts = df.groupby(by, observed = True).size().rename('n')
+    counts = counts.reset_index()
+    for column in by:
+        # plain values so every representation of the crime data gives the same table
+        if counts[column].dtype.name == 'category':
+            counts[column] = counts[column].astype(object)
+    return counts.sort_values(by).reset_index(drop = True)
+
+def is_crime_count(df, by):
+    """
+    Whether df is already a table of crime counts n by the given columns
+    """
+    return isinstance(df, pd.DataFrame) and list(df.columns) == by + ['n']
+
 def crime_bar_chart(df):
     """
     Create the bar chart to display top ten crimes/ selected crimes  
@@ -178,22 +337,31 @@ def crime_bar_chart(df):
     Parameters
     ----------
     df : 
-        wrangled dataframe to produce the bar chart
+        crime counts by OFFENSE_CODE_GROUP from count_crimes(), or the wrangled 
+        dataframe or filtered CrimeCube to count them from
 
     Returns
     -------
     altair plot :
         altair bar plot 
     """
+    if not is_crime_count(df, ['OFFENSE_CODE_GROUP']):
+        df = count_crimes(df, ['OFFENSE_CODE_GROUP'])
+    # the ten most common crimes, picked from the counts in name order as a groupby size picks them
+    top = df['n'].sort_values(ascending = False)[:10]
+    df = df[df.index.isin(top.index)]
+    return fill_template(('crime_bar_chart',), draw_crime_bar_chart, df)
 
-    df_year_grouped = df.groupby('OFFENSE_CODE_GROUP').size().sort_values(ascending = False)[:10]
-    df = df[df['OFFENSE_CODE_GROUP'].isin(df_year_grouped.index)]
-    
+def draw_crime_bar_chart(df):
+    """
+    Draws the bar chart of the crime counts by OFFENSE_CODE_GROUP in altair
+    """
     crime_type_chart = alt.Chart(df).mark_bar().encode(
-        y = alt.X('OFFENSE_CODE_GROUP:O', title = "Crime", sort=alt.EncodingSortField(op="count", order='descending')),
-        x = alt.Y('count():Q', title = "Crime Count"),
+        y = alt.X('OFFENSE_CODE_GROUP:O', title = "Crime", 
+                  sort = alt.EncodingSortField(field = 'n', op = "sum", order = 'descending')),
+        x = alt.Y('sum(n):Q', title = "Crime Count"),
         tooltip = [alt.Tooltip('OFFENSE_CODE_GROUP:O', title = 'Crime'),
-                    alt.Tooltip('count():Q', title = 'Crime Count')]
+                    alt.Tooltip('sum(n):Q', title = 'Crime Count')]
     ).properties(title = "Crime Count by Type", width=250, height=250)
     return crime_type_chart
 
@@ -211,6 +379,12 @@ def boston_map(df):
     altair plot :
         altair Choropleth map 
     """
+    return fill_template(('boston_map',), draw_boston_map, df)
+
+def draw_boston_map(df):
+    """
+    Draws the choropleth of the neighbourhood features in altair
+    """
     boston_map = gen_map(geodata = df, 
                         color_column='properties.YEAR', 
                        # color_scheme='yelloworangered',
@@ -222,38 +396,104 @@ def boston_map(df):
     return boston_map
 
 
-def trendgraph(df, filter_1_year = True):
+def count_trend(df, granularity = 'month'):
+    """
+    Counts the crimes per month, week or day for the trend plot
+
+    Parameters
+    ----------
+    df : 
+        wrangled dataframe or filtered CrimeCube, weekly and daily counts need 
+        the DATE column or the daily counts of the cube
+    granularity : string
+        'month', 'week' or 'day'
+
+    Returns
+    -------
+    Pandas Data Frame
+        the date of every period with crimes and its count n of crimes with an 
+        OFFENSE_CODE_GROUP, the YEAR and MONTH of monthly periods
+    """
+    if isinstance(df, CrimeCube):
+        return df.trend(granularity)
+    if df['OFFENSE_CODE_GROUP'].hasnans:
+        # only crimes with an OFFENSE_CODE_GROUP are counted
+        df = df[df['OFFENSE_CODE_GROUP'].notna()]
+    if granularity == 'month':
+        dfg = df.groupby(['YEAR', 'MONTH']).size().rename('n').reset_index()
+        dfg.insert(2, 'date', pd.to_datetime({'year': dfg['YEAR'],
+                                              'month': dfg['MONTH'],
+                                              'day': 1}))
+        return dfg
+    if 'DATE' not in df.columns:
+        raise ValueError("%s trends need the DATE column, reload the crime data" % granularity)
+    dates = pd.to_datetime(df['DATE'].to_numpy().astype(np.int64), unit = 'D')
+    if granularity == 'week':
+        # weeks start on Monday
+        dates = dates - pd.to_timedelta(dates.dayofweek, unit = 'D')
+    elif granularity != 'day':
+        raise ValueError("Unknown trend granularity %r, expected 'month', 'week' or 'day'" % granularity)
+    return pd.Series(dates).value_counts().sort_index().rename_axis('date').rename('n').reset_index()
+
+def is_trend_count(df):
+    """
+    Checks whether df already holds the crime counts over time from count_trend()
+    """
+    return isinstance(df, pd.DataFrame) and list(df.columns[-2:]) == ['date', 'n']
+
+def trendgraph(df, filter_1_year = True, granularity = 'month'):
     """
     Create the line graph to display  
     
     Parameters
     ----------
     df : 
-        wrangled dataframe to produce the line graph
+        crime counts over time from count_trend(), or the wrangled dataframe 
+        or filtered CrimeCube to count them from
+    granularity : string
+        plot the crimes per 'month', 'week' or 'day'
 
     Returns
     -------
     altair plot :
         altair line plot 
     """
-    dfg = df.groupby(['YEAR', 'MONTH']).count().reset_index()
-    dfg['date'] = pd.to_datetime({'year': dfg['YEAR'],
-                             'month': dfg['MONTH'],
-                             'day': 1})
+    if not is_trend_count(df):
+        df = count_trend(df, granularity = granularity)
+    dfg = df.rename(columns = {'n': 'OFFENSE_CODE_GROUP'})
     if filter_1_year == True:
         year_format = "%b"
     else:
         year_format = "%b %Y"
+    if granularity != 'month':
+        dfg = dfg[['OFFENSE_CODE_GROUP', 'date']]
+    return fill_template(('trendgraph', year_format, granularity), 
+                         lambda data: draw_trendgraph(data, year_format, granularity), dfg)
+
+def draw_trendgraph(dfg, year_format, granularity):
+    """
+    Draws the line graph of the crime counts over time in altair with the 
+    given date format of the x axis
+    """
+    if granularity == 'month':
+        tooltip = [alt.Tooltip('YEAR:O', title = 'Year'),
+                   alt.Tooltip('MONTH:O', title = 'Month'),
+                    alt.Tooltip('OFFENSE_CODE_GROUP:Q', title = 'Crime Count')]
+    else:
+        tooltip = [alt.Tooltip('date:T', title = 'Week of' if granularity == 'week' else 'Date',
+                               format = '%b %d %Y'),
+                    alt.Tooltip('OFFENSE_CODE_GROUP:Q', title = 'Crime Count')]
     trendgraph = alt.Chart(dfg
     ).mark_line().encode(
         x = alt.X("date:T", 
                   title = "Date",
                  axis = alt.Axis(labelAngle = 0, format = year_format)),
         y = alt.Y('OFFENSE_CODE_GROUP:Q', title = "Crime Count"),
-        tooltip = [alt.Tooltip('YEAR:O', title = 'Year'),
-                   alt.Tooltip('MONTH:O', title = 'Month'),
-                    alt.Tooltip('OFFENSE_CODE_GROUP:Q', title = 'Crime Count')]
+        tooltip = tooltip
     ).properties(title = "Crime Trend", width=350, height=250)
+    if granularity == 'day':
+        # a point per day hides the line
+        return trendgraph
     return trendgraph + trendgraph.mark_point()
 
 def heatmap(df):
@@ -263,13 +503,22 @@ def heatmap(df):
     Parameters
     ----------
     df : 
-        wrangled dataframe to produce the bar chart
+        crime counts by DAY_OF_WEEK and HOUR from count_crimes(), or the wrangled 
+        dataframe or filtered CrimeCube to count them from
 
     Returns
     -------
     altair plot :
         altair heatmap plot 
     """
+    if not is_crime_count(df, ['DAY_OF_WEEK', 'HOUR']):
+        df = count_crimes(df, ['DAY_OF_WEEK', 'HOUR'])
+    return fill_template(('heatmap',), draw_heatmap, df)
+
+def draw_heatmap(df):
+    """
+    Draws the heatmap of the crime counts by DAY_OF_WEEK and HOUR in altair
+    """
     heatmap = alt.Chart(df).mark_rect().encode(
         x = alt.X("HOUR:O", title = "Hour of Day", 
                   axis = alt.Axis(labelAngle = 0)),
@@ -277,14 +526,32 @@ def heatmap(df):
                   sort = ["Monday", "Tuesday", "Wednesday", 
                         "Thursday", "Friday", "Saturday", "Sunday"],
                   title = "Day of Week"),
-        color = alt.Color('count()', legend = alt.Legend(title = "Crime Count")),
+        color = alt.Color('sum(n):Q', legend = alt.Legend(title = "Crime Count")),
         tooltip = [alt.Tooltip('DAY_OF_WEEK:O', title = 'Day'),
                    alt.Tooltip('HOUR:O', title = 'Hour'),
-                    alt.Tooltip('count()', title = 'Crime Count')]
+                    alt.Tooltip('sum(n):Q', title = 'Crime Count')]
     ).properties(title = "Occurence of Crime by Hour and Day", width=200, height=250
     ).configure_legend(labelFontSize=14, titleFontSize=16)
     return heatmap
 
+def compile_chart_templates():
+    """
+    Compiles the spec template of every chart layout under the active theme, 
+    so requests only fill in the data of their charts 
+    """
+    empty_counts = pd.Series([], dtype = np.int64, name = 'n')
+    crime_bar_chart(pd.DataFrame({'OFFENSE_CODE_GROUP': [], 'n': empty_counts}))
+    heatmap(pd.DataFrame({'DAY_OF_WEEK': [], 'HOUR': [], 'n': empty_counts}))
+    boston_map(alt.Data(values = []))
+    dates = pd.to_datetime(pd.Series([], dtype = 'datetime64[ns]'))
+    for granularity in ['month', 'week', 'day']:
+        if granularity == 'month':
+            counts = pd.DataFrame({'YEAR': [], 'MONTH': [], 'date': dates, 'n': empty_counts})
+        else:
+            counts = pd.DataFrame({'date': dates, 'n': empty_counts})
+        for single_year in [True, False]:
+            trendgraph(counts, filter_1_year = single_year, granularity = granularity)
+
 # set theme
 def mds_special():
     """
@@ -342,7 +609,7 @@ def mds_special():
         }
     }
 ## wrap all the other functions
-def make_choro_plot(df, gdf, year = None, month = None, neighbourhood = None, crime = None):
+def make_choro_plot(df, gdf, year = None, month = None, neighbourhood = None, crime = None, features = None):
     """
     Wrapper function to filter data, make proper geo data frame and make choropleth map 
     
@@ -358,17 +625,23 @@ def make_choro_plot(df, gdf, year = None, month = None, neighbourhood = None, cr
         neighbourhood or neighbourhoods of where crime occurs 
     crime : string or list 
         crime or crimes commited to be displayed
+    features : dictionary
+        neighbourhood geometry placeholders from serialize_geo_features(), 
+        the chart is then serialized with their fragments
 
     Returns
     -------
     function call to boston_map() to make the choropleth map 
     """
-    df = chart_filter(df, year = year, month = month, crime = crime)
-    gdf = create_merged_gdf(df, gdf, neighbourhood = neighbourhood)
-    choro_data = create_geo_data(gdf)
-    return  boston_map(choro_data)
+    with chart_metrics.phase('filter'):
+        df = chart_filter(df, year = year, month = month, crime = crime)
+    with chart_metrics.phase('aggregate'):
+        gdf = create_merged_gdf(df, gdf, neighbourhood = neighbourhood)
+    with chart_metrics.phase('spec'):
+        choro_data = create_geo_data(gdf, features = features)
+        return  boston_map(choro_data)
 
-def make_trend_plot(df, year = None, neighbourhood = None, crime = None):
+def make_trend_plot(df, year = None, neighbourhood = None, crime = None, granularity = 'month'):
     """
     Wrapper function to make filter data, make proper geo data frame and make trends plot
     
@@ -382,14 +655,20 @@ def make_trend_plot(df, year = None, neighbourhood = None, crime = None):
         neighbourhood or neighbourhoods of where crime occurs 
     crime : string or list 
         crime or crimes commited to be displayed
+    granularity : string
+        plot the crimes per 'month', 'week' or 'day'
 
     Returns
     -------
     function call to trendgraph() to make the trends plot 
     """
-    df = chart_filter(df, year = year, neighbourhood = neighbourhood, crime = crime)
+    with chart_metrics.phase('filter'):
+        df = chart_filter(df, year = year, neighbourhood = neighbourhood, crime = crime)
+    with chart_metrics.phase('aggregate'):
+        counts = count_trend(df, granularity = granularity)
     single_year = year_filter(year = year)
-    return  trendgraph(df, filter_1_year = single_year)
+    with chart_metrics.phase('spec'):
+        return  trendgraph(counts, filter_1_year = single_year, granularity = granularity)
 
 def make_heatmap_plot(df, year = None, month = None, neighbourhood = None, crime = None):
     """
@@ -412,8 +691,12 @@ def make_heatmap_plot(df, year = None, month = None, neighbourhood = None, crime
     -------
     function call to heatmap() to make the heatmap 
     """
-    df = chart_filter(df, year = year, month = month, neighbourhood = neighbourhood, crime = crime)
-    return  heatmap(df)
+    with chart_metrics.phase('filter'):
+        df = chart_filter(df, year = year, month = month, neighbourhood = neighbourhood, crime = crime)
+    with chart_metrics.phase('aggregate'):
+        counts = count_crimes(df, ['DAY_OF_WEEK', 'HOUR'])
+    with chart_metrics.phase('spec'):
+        return  heatmap(counts)
 
 def make_bar_plot(df, year = None, month = None, neighbourhood = None, crime=None):
     """
@@ -436,28 +719,36 @@ def make_bar_plot(df, year = None, month = None, neighbourhood = None, crime=Non
     -------
     function call to boston_map() to make the bar plot 
     """
-    df = chart_filter(df, year = year, month = month, neighbourhood = neighbourhood, crime=crime)
-    return  crime_bar_chart(df)
+    with chart_metrics.phase('filter'):
+        df = chart_filter(df, year = year, month = month, neighbourhood = neighbourhood, crime=crime)
+    with chart_metrics.phase('aggregate'):
+        counts = count_crimes(df, ['OFFENSE_CODE_GROUP'])
+    with chart_metrics.phase('spec'):
+        return  crime_bar_chart(counts)
 
 geo_json_file_loc= 'data/Boston_Neighborhoods.geojson'
 
-def open_geojson():
+def open_geojson(path = None):
     """
-    Opens geojson file
+    Opens geojson file, by default the Boston neighbourhoods
     """
-    with open(geo_json_file_loc) as json_data:
+    if path is None:
+        path = geo_json_file_loc
+    with open(path) as json_data:
         d = json.load(json_data)
     return d
 
-def get_gpd_df():
+def get_gpd_df(path = None):
     """
     Creates a geopandas dataframe object
 
     Parameters
     ----------
-    df : Pandas Data Frame
-        Dataframe of crime data
+    path : string
+        geojson file of the neighbourhoods, by default the Boston neighbourhoods
     """
-    boston_json = open_geojson()
+    boston_json = open_geojson(path)
     gdf = gpd.GeoDataFrame.from_features((boston_json))
+    # index by neighbourhood so create_merged_gdf looks districts up directly
+    gdf.index = pd.Index(gdf['Name'], name = 'Name')
     return gdf
\ No newline at end of file
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [1000, 10000, 100000, 1000000, 10000000]
+# exported metrics, their type, help text and buckets
+METRICS = {"chart_phase_seconds": ("histogram", "Seconds spent in each phase of rendering a chart",
+                                   LATENCY_BUCKETS),
+           "chart_seconds": ("histogram", "Seconds to answer a chart from the cache or by rendering it",
+                             LATENCY_BUCKETS),
+           "chart_response_bytes": ("histogram", "Size of the chart html sent to the browser", SIZE_BUCKETS),
+           "chart_cache_lookups_total": ("counter", "Chart cache lookups by result", None),
+           "callback_seconds": ("histogram", "Seconds spent in the chart callback", LATENCY_BUCKETS),
+           "callbacks_superseded_total": ("counter", "Chart callbacks dropped for a newer one of the same session",
+                                          None)}
+
+class MetricsRegistry:
+    """
+    Counters and histograms exported in the Prometheus text format. Series are
+    identified by their metric name and label values and kept in the process
+    until share() moves them to a file shared with the other processes.
+    """
+    def __init__(self, metrics = METRICS):
+        self.metrics = metrics
+        self.series = {}
+        self.path = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def share(self, path):
+        """
+        Keeps the series in an SQLite file that every process sharing it adds
+        to, so render() exports the series of all the gunicorn workers and
+        chart processes on the host instead of those of the calling process
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS samples ("
+                       "name TEXT, labels TEXT, field TEXT, value NUMERIC, PRIMARY KEY (name, labels, field))")
+
+    def connect(self):
+        """
+        Returns the sqlite connection of the calling thread, connections are
+        not shared across threads or forked processes
+        """
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout = 30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def add(self, name, labels, amounts):
+        """
+        Adds (field, amount) pairs to the fields of a series in the shared file
+        """
+        labels = json.dumps(labels)
+        db = self.connect()
+        with db:
+            db.executemany("INSERT INTO samples VALUES (?, ?, ?, ?) ON CONFLICT (name, labels, field) "
+                           "DO UPDATE SET value = value + excluded.value",
+                           [(name, labels, field, amount) for field, amount in amounts])
+
+    def inc(self, name, labels, amount = 1):
+        """
+        Adds to a counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        if self.path is not None:
+            self.add(name, key[1], [("value", amount)])
+            return
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """
+        Records a value in a histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.metrics[name][2]
+        if self.path is not None:
+            self.add(name, key[1], [("bucket %d" % position, 1) for position, bound in enumerate(buckets)
+                                    if value <= bound] + [("sum", value), ("count", 1)])
+            return
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    series["buckets"][position] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times a phase of the chart tracked by the calling thread, phases run
+        outside of track() are not recorded
+        """
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = getattr(self.local, "phases", None)
+            if phases is not None:
+                phases[name] = phases.get(name, 0) + time.perf_counter() - began
+
+    @contextmanager
+    def track(self, chart):
+        """
+        Records the time of every phase() run by the calling thread while
+        rendering a chart
+        """
+        self.local.phases = phases = {}
+        try:
+            yield
+        finally:
+            self.local.phases = None
+            for name, seconds in phases.items():
+                self.observe("chart_phase_seconds", {"chart": chart, "phase": name}, seconds)
+
+    def collect(self):
+        """
+        Returns a sorted copy of every (key, value) series, counters hold a
+        number and histograms a dict of bucket counts, sum and count
+        """
+        if self.path is None:
+            with self.lock:
+                series = sorted(self.series.items(), key = lambda item: item[0])
+                return [(key, dict(value, buckets = list(value["buckets"])) if isinstance(value, dict) else value)
+                        for key, value in series]
+        series = {}
+        for name, labels, field, value in self.connect().execute("SELECT * FROM samples"):
+            if name not in self.metrics:
+                continue
+            key = (name, tuple(tuple(pair) for pair in json.loads(labels)))
+            if self.metrics[name][0] == "counter":
+                series[key] = value
+                continue
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {"buckets": [0] * len(self.metrics[name][2]), "sum": 0.0, "count": 0}
+            if field.startswith("bucket "):
+                histogram["buckets"][int(field.split()[1])] = value
+            else:
+                histogram[field] = value
+        return sorted(series.items(), key = lambda item: item[0])
+
+    def render(self):
+        """
+        Returns every series in the Prometheus text exposition format
+        """
+        series = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in self.metrics.items():
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for (series_name, labels), value in series:
+                if series_name != name:
+                    continue
+                if kind == "counter":
+                    lines.append("%s%s %s" % (name, format_labels(labels), value))
+                    continue
+                for bound, count in zip(buckets, value["buckets"]):
+                    lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", repr(float(bound))),)),
+                                                     count))
+                lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", "+Inf"),)), value["count"]))
+                lines.append("%s_sum%s %r" % (name, format_labels(labels), value["sum"]))
+                lines.append("%s_count%s %d" % (name, format_labels(labels), value["count"]))
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    """
+    Formats label pairs as {name="value",...}
+    """
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for name, value in labels]
+    return "{" + ",".join('%s="%s"' % pair for pair in escaped) + "}"
+
+# metrics of the app, helpers record their phases here
+chart_metrics = MetricsRegistry()
@@ -0,0 +1,86 @@
+"""
+Renders the charts of the filter states most visitors see, the page as it
+opens and every single year or single neighbourhood selection of every city,
+and saves them for the app to serve without rendering. Run it at deploy time
+with the same environment variables as the app, the charts are only used
+while the crime data and the chart settings they were rendered with are
+unchanged.
+
+    python precompute.py
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+from files import replace_file
+
+## FUNCTIONS
+def common_states(year_range, neighbourhoods):
+    """
+    Returns the filter states to precompute as (year, neighbourhood, crime)
+
+    Parameters
+    ----------
+    year_range : list
+        first and last year of the year slider
+    neighbourhoods : list
+        neighbourhoods of the neighbourhood dropdown
+
+    Returns
+    -------
+    list
+        the default state, every single year and every single neighbourhood
+    """
+    states = [(list(year_range), None, None)]
+    states += [([year, year], None, None) for year in range(year_range[0], year_range[1]+1)]
+    states += [(list(year_range), [neighbourhood], None) for neighbourhood in neighbourhoods]
+    return states
+
+def save_charts(path, charts, datasets = None):
+    """
+    Writes the precomputed charts by cache key along with the datasets they
+    load from the chart data store by name, replacing the file in one step
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with replace_file(path, "wb") as charts_file:
+        pickle.dump({"charts": charts, "datasets": datasets or {}}, charts_file, protocol = pickle.HIGHEST_PROTOCOL)
+
+def load_charts(path, store = None):
+    """
+    Reads the precomputed charts by cache key, an empty dictionary when there
+    are none. Their datasets are published to the chart data store and kept
+    from being pruned, as the charts are never rendered again.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as charts_file:
+        precomputed = pickle.load(charts_file)
+    if store is not None:
+        store.pin(precomputed["datasets"])
+    return precomputed["charts"]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    import app
+    from chart_data import referenced_data
+    charts = {}
+    datasets = {}
+    began = time.perf_counter()
+    app.ensure_loaded()
+    for dataset_id in app.dataset_registry.ids():
+        dataset = app.get_dataset(dataset_id)
+        for year, neighbourhood, crime in common_states(dataset.year_range, dataset.neighbourhood_list):
+            for update, key, render in app.plot_renders(year, neighbourhood, crime, 'month', dataset_id):
+                charts[key] = render()
+                if app.chart_store is not None:
+                    # the charts carry their datasets so they do not depend on the store they were rendered with
+                    for name in referenced_data(charts[key], app.chart_data_url):
+                        datasets[name] = app.chart_store.get(name)
+    save_charts(app.precomputed_path, charts, datasets)
+    print("Rendered %d charts in %.1fs to %s" % (len(charts), time.perf_counter() - began, app.precomputed_path),
+          file = sys.stderr)
@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+## FUNCTIONS
+def frame_stack(frame):
+    """
+    Returns the call stack of a frame from the outermost call as
+    "function (file:line)" strings
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return stack[::-1]
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler for slow requests. While a request runs a background
+    thread records the stack of the request's thread every interval seconds,
+    and requests taking at least threshold seconds are written to the
+    directory as collapsed stacks, the input of flamegraph.pl and speedscope.
+    """
+    def __init__(self, directory, threshold = 1.0, interval = 0.005):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        os.makedirs(directory, exist_ok = True)
+
+    def sample(self, thread_id, samples, done):
+        """
+        Counts the stacks of a thread until done is set
+        """
+        while not done.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                samples[";".join(frame_stack(frame))] += 1
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Samples the calling thread while the block runs and writes the samples
+        to <directory>/<name>-<time>-<pid>.folded if it took threshold seconds
+        """
+        samples = Counter()
+        done = threading.Event()
+        sampler = threading.Thread(target = self.sample, args = (threading.get_ident(), samples, done),
+                                   daemon = True)
+        began = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+            if time.perf_counter() - began >= self.threshold and samples:
+                path = os.path.join(self.directory, "%s-%s-%d.folded"
+                                    % (name, time.strftime("%Y%m%dT%H%M%S"), os.getpid()))
+                with open(path, "w") as profile_file:
+                    for stack, count in samples.most_common():
+                        profile_file.write("%s %d\n" % (stack, count))
@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+class SharedRenders:
+    """
+    Renders in flight by cache key. A callback asking for a chart that another
+    callback is already rendering waits for that render instead of repeating it.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.shared = 0
+        self.lock = threading.Lock()
+
+    def run(self, key, render):
+        """
+        Returns render() or the result of the render of the same key in flight
+        """
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+        try:
+            value = render()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+class ChartPool:
+    """
+    Renders the charts of a callback concurrently on a pool of threads. In
+    process mode the threads hand every render to a pool of processes forked
+    from a server process that imported the preload modules, so they load the
+    data once instead of receiving it with each render. The server process
+    starts without threads, a process forked from the app itself could inherit
+    a lock held by another of its threads and hang on it.
+    """
+    def __init__(self, workers = 4, mode = "thread", preload = ()):
+        if mode not in ["thread", "process"]:
+            raise ValueError("Unknown chart pool mode %r, expected 'thread' or 'process'" % mode)
+        self.workers = workers
+        self.mode = mode
+        # forked children of the process must create their own pool
+        self.pid = os.getpid()
+        self.threads = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "chart")
+        self.processes = None
+        if mode == "process":
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(list(preload))
+            self.processes = ProcessPoolExecutor(max_workers = workers, mp_context = context)
+        self.shared = SharedRenders()
+
+    def map(self, function, calls):
+        """
+        Calls the function with every tuple of arguments concurrently and
+        returns the results in order, raising the first error
+        """
+        futures = [self.threads.submit(function, *arguments) for arguments in calls]
+        return [future.result() for future in futures]
+
+    def render(self, key, render):
+        """
+        Renders a chart, in a forked process in process mode, sharing the
+        render with concurrent requests for the same key
+        """
+        if self.processes is None:
+            return self.shared.run(key, render)
+        return self.shared.run(key, lambda: self.processes.submit(render).result())
+
+    def stats(self):
+        return {"mode": self.mode, "workers": self.workers, "shared": self.shared.shared}
+
+    def shutdown(self, wait = False):
+        """
+        Stops the threads and processes of the pool. A copy of the pool in a
+        forked child leaves them alone, they belong to the process that created
+        the pool and the child has none of its threads.
+        """
+        if self.pid != os.getpid():
+            return
+        self.threads.shutdown(wait = wait)
+        if self.processes is not None:
+            self.processes.shutdown(wait = wait)
@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+
+# columns with an inverted index and the chart_filter argument they answer
+INDEXED_COLUMNS = {"YEAR": "year", "MONTH": "month", "DISTRICT": "neighbourhood", "OFFENSE_CODE_GROUP": "crime"}
+RANGE_COLUMNS = ["YEAR", "MONTH"]
+
+## FUNCTIONS
+def build_postings(series):
+    """
+    Builds the inverted index of a column, the sorted row ids of every value
+    stored back to back in one int32 array
+
+    Parameters
+    ----------
+    series : Pandas Series
+        column of the crime data
+
+    Returns
+    -------
+    tuple
+        the column values, the offset of each value's row ids and the row ids
+    """
+    if series.dtype.name == 'category':
+        codes, labels = series.cat.codes.to_numpy(), pd.Index(series.cat.categories)
+    else:
+        codes, labels = pd.factorize(series, sort = True)
+    # missing values (code -1) sort first and are dropped from the postings
+    order = np.argsort(codes, kind = 'stable').astype(np.int32)
+    counts = np.bincount(codes + 1, minlength = len(labels) + 1)
+    offsets = np.cumsum(counts)
+    return labels, offsets - offsets[0], order[offsets[0]:]
+
+def segment_postings(labels, added, first_row):
+    """
+    Returns the postings of new rows as a segment following the postings of a
+    column, with offsets over the values of the column and row ids counted
+    from its first row
+
+    Parameters
+    ----------
+    labels : Pandas Index
+        the values of the column
+    added : tuple
+        the postings of the new rows from build_postings, every value must be in labels
+    first_row : int
+        row id of the first new row
+
+    Returns
+    -------
+    tuple
+        the column values, offsets and row ids of the new rows
+    """
+    added_labels, added_offsets, added_rows = added
+    positions = labels.get_indexer(added_labels)
+    if (positions < 0).any():
+        raise ValueError("New values %s are not in the index" % list(added_labels[positions < 0]))
+    counts = np.zeros(len(labels), dtype = np.int64)
+    counts[positions] = np.diff(added_offsets)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    rows = np.empty(offsets[-1], dtype = np.int32)
+    for added_position, position in enumerate(positions):
+        rows[offsets[position]:offsets[position+1]] = (
+            added_rows[added_offsets[added_position]:added_offsets[added_position+1]] + first_row)
+    return labels, offsets, rows
+
+def merge_postings(segments):
+    """
+    Merges consecutive postings segments of a column into one
+
+    Parameters
+    ----------
+    segments : list
+        the (values, offsets, row ids) segments, the rows of every segment
+        coming after those of the segments before it
+
+    Returns
+    -------
+    tuple
+        the column values, offsets and row ids of all the rows
+    """
+    labels = segments[0][0]
+    counts = [np.diff(offsets) for values, offsets, rows in segments]
+    merged_offsets = np.concatenate([[0], np.cumsum(np.sum(counts, axis = 0))])
+    merged_rows = np.empty(merged_offsets[-1], dtype = np.int32)
+    for position in range(len(labels)):
+        start = merged_offsets[position]
+        # each segment's rows follow those of the segments before it, so each value stays in row order
+        for values, offsets, rows in segments:
+            part = rows[offsets[position]:offsets[position+1]]
+            merged_rows[start:start + len(part)] = part
+            start += len(part)
+    return labels, merged_offsets, merged_rows
+
+def intersect_sorted(a, b):
+    """
+    Intersects two sorted arrays of unique row ids by searching the smaller one
+    in the larger one
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    positions = np.searchsorted(b, a)
+    positions[positions == len(b)] = 0
+    return a[b[positions] == a]
+
+class CrimeIndex:
+    """
+    Crime data with an inverted index of row ids per value of the filtered
+    columns. Filters are answered by merging the row ids of the selected
+    values, so rows that do not match are never read. The index of a column
+    is a list of postings segments, the rows appended to a crime store get
+    their own segments. The crime data is a data frame or the CrimeColumns of
+    a crime store.
+    """
+    def __init__(self, df, postings = None):
+        self.df = df
+        if postings is None:
+            postings = {column: [build_postings(df[column])] for column in INDEXED_COLUMNS}
+        self.postings = postings
+
+    def value_rows(self, column, value):
+        """
+        Returns the sorted row ids of the rows matching a chart_filter value
+
+        Parameters
+        ----------
+        column : string
+            indexed column
+        value : int, string or list
+            value or values to match, a list of two values is a range for YEAR and MONTH
+
+        Returns
+        -------
+        numpy array
+            sorted int32 row ids
+        """
+        segments = self.postings[column]
+        if type(value) == list:
+            if column in RANGE_COLUMNS:
+                value = list(range(value[0], value[1]+1))
+        else:
+            value = [value]
+        positions = np.flatnonzero(segments[0][0].isin(value))
+        parts = [rows[offsets[position]:offsets[position+1]]
+                 for labels, offsets, rows in segments for position in positions]
+        parts = [part for part in parts if len(part) > 0]
+        if len(parts) == 0:
+            return np.empty(0, dtype = np.int32)
+        if len(parts) == 1:
+            return parts[0]
+        if len(positions) == 1:
+            # the rows of one value, segment after segment
+            return np.concatenate(parts)
+        # the union of several values, each already in row order
+        return np.sort(np.concatenate(parts))
+
+    def rows(self, year = None, month = None, neighbourhood = None, crime = None, date = None):
+        """
+        Returns the sorted row ids matching every given filter, None when no
+        filter is given. The date range has no index, it is checked on the rows
+        matching the other filters.
+        """
+        filters = {"year": year, "month": month, "neighbourhood": neighbourhood, "crime": crime}
+        matches = []
+        for column, argument in INDEXED_COLUMNS.items():
+            value = filters[argument]
+            if value is None or (value == [] and column not in RANGE_COLUMNS):
+                continue
+            matches.append(self.value_rows(column, value))
+        rows = None
+        if matches:
+            # intersect from the most selective filter so every step is small
+            matches.sort(key = len)
+            rows = matches[0]
+            for match in matches[1:]:
+                rows = intersect_sorted(rows, match)
+        if date is not None:
+            first, last = date if type(date) == list else [date, date]
+            days = self.df["DATE"].to_numpy()
+            if rows is None:
+                rows = np.flatnonzero((days >= first) & (days <= last)).astype(np.int32)
+            else:
+                row_days = days[rows]
+                rows = rows[(row_days >= first) & (row_days <= last)]
+        return rows
+
+    def filter(self, year = None, month = None, neighbourhood = None, crime = None, date = None):
+        """
+        Filters the crime data the same way chart_filter filters a data frame
+
+        Parameters
+        ----------
+        year : int or list
+            year or range of years to keep
+        month : int or list
+            month or range of months to keep
+        neighbourhood : string or list
+            neighbourhood or neighbourhoods to keep
+        crime : string or list
+            crime or crimes to keep
+        date : int or list
+            day or range of days to keep, in days since 1970-01-01
+
+        Returns
+        -------
+        Pandas Data Frame
+            the matching rows in their original order
+        """
+        rows = self.rows(year = year, month = month, neighbourhood = neighbourhood, crime = crime, date = date)
+        if isinstance(self.df, pd.DataFrame):
+            return self.df if rows is None else self.df.take(rows)
+        # only the selected rows of the CrimeColumns of a crime store are read
+        return self.df.frame(slice(None) if rows is None else rows)
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class LatestRequests:
+    """
+    Tracks the latest chart request of every browser session, so a render that
+    a newer request of the same session superseded can stop before it does
+    more work. Only the max_sessions most recently active sessions are kept.
+    """
+    def __init__(self, max_sessions = 10000):
+        self.max_sessions = max_sessions
+        self.generations = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, session):
+        """
+        Registers a new request of a session and returns its generation, None
+        for requests without a session
+        """
+        if session is None:
+            return None
+        with self.lock:
+            generation = self.generations.pop(session, 0) + 1
+            self.generations[session] = generation
+            while len(self.generations) > self.max_sessions:
+                self.generations.popitem(last = False)
+            return generation
+
+    def is_current(self, session, generation):
+        """
+        Checks whether a request is still the latest of its session
+        """
+        if session is None:
+            return True
+        with self.lock:
+            return self.generations.get(session, generation) == generation
+
+class SharedLatestRequests:
+    """
+    Latest chart request of every browser session kept in an SQLite file
+    shared by every worker process on the host, so a request is superseded
+    by a newer one of its session whichever worker answers it. Only the
+    max_sessions most recently active sessions are kept.
+    """
+    def __init__(self, path, max_sessions = 10000, trim_every = 100):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.trim_every = trim_every
+        self.starts = 0
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                       "session TEXT PRIMARY KEY, generation INTEGER, accessed REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed)")
+
+    def connect(self):
+        """
+        Returns the sqlite connection of the calling thread, connections are
+        not shared across threads or forked processes
+        """
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout = 30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def start(self, session):
+        """
+        Registers a new request of a session and returns its generation, None
+        for requests without a session
+        """
+        if session is None:
+            return None
+        db = self.connect()
+        with db:
+            db.execute("INSERT INTO sessions VALUES (?, 1, ?) ON CONFLICT (session) "
+                       "DO UPDATE SET generation = generation + 1, accessed = excluded.accessed",
+                       (session, time.time()))
+            generation = db.execute("SELECT generation FROM sessions WHERE session = ?", (session,)).fetchone()[0]
+            self.starts += 1
+            if self.starts % self.trim_every == 0:
+                db.execute("DELETE FROM sessions WHERE session NOT IN "
+                           "(SELECT session FROM sessions ORDER BY accessed DESC LIMIT ?)", (self.max_sessions,))
+        return generation
+
+    def is_current(self, session, generation):
+        """
+        Checks whether a request is still the latest of its session
+        """
+        if session is None:
+            return True
+        row = self.connect().execute("SELECT generation FROM sessions WHERE session = ?", (session,)).fetchone()
+        return row is None or row[0] == generation
@@ -0,0 +1,137 @@
+"""
+Checks that the crime cube, the row index and the crime store count the
+crimes like the crime data frame does, also after new records are appended
+and when the store is streamed from a csv. The filters include date ranges
+that split weeks.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from aggregates import build_cube, merge_cubes
+from benchmarks.synthetic import generate_crime_data, write_crime_csv
+from data_store import append_crime_store, load_crime_store, read_store_meta, save_crime_store, stream_crime_store
+from helpers import chart_filter, count_crimes, count_trend
+from row_index import CrimeIndex
+
+FILTERS = [{},
+           {'year': [2016, 2017]},
+           {'year': 2018, 'month': [3, 5]},
+           {'neighbourhood': ['Roxbury', 'Downtown']},
+           {'neighbourhood': 'Dorchester', 'crime': 'Towed'},
+           {'month': [6, 8], 'crime': ['Larceny', 'Vandalism']},
+           {'neighbourhood': [], 'crime': []}]
+CHART_COUNTS = [['DISTRICT'], ['OFFENSE_CODE_GROUP'], ['DAY_OF_WEEK', 'HOUR']]
+
+@pytest.fixture(scope = 'module')
+def crimes():
+    return generate_crime_data(20000, seed = 3)
+
+@pytest.fixture(scope = 'module')
+def cube(crimes):
+    return build_cube(crimes)
+
+def chart_filters(cube):
+    """
+    Returns FILTERS along with date ranges starting and ending in the middle
+    of a week, single days, ranges outside the data and date ranges combined
+    with the other filters
+    """
+    first = cube.first_day
+    last = cube.first_day + len(cube.daily) - 1
+    return FILTERS + [{'date': [first + 3, first + 17]},
+                      {'date': [first + 10, first + 10]},
+                      {'date': [first - 5, first + 2]},
+                      {'date': [last - 9, last + 30]},
+                      {'date': [last + 1, last + 9]},
+                      {'date': [first + 40, last - 40], 'month': [3, 5]},
+                      {'date': [first + 100, last], 'month': [11, 12], 'year': [2016, 2017]},
+                      {'date': [first + 1, first + 400], 'crime': ['Larceny', 'Towed'],
+                       'neighbourhood': ['Roxbury']}]
+
+def assert_same_counts(cube, crimes, filters):
+    expected = chart_filter(crimes, **filters)
+    selection = chart_filter(cube, **filters)
+    assert selection.total() == len(expected)
+    for by in CHART_COUNTS:
+        pd.testing.assert_frame_equal(count_crimes(selection, by), count_crimes(expected, by), check_dtype = False)
+    for granularity in ['month', 'week', 'day']:
+        pd.testing.assert_frame_equal(count_trend(selection, granularity), count_trend(expected, granularity),
+                                      check_dtype = False)
+
+def assert_same_rows(index, crimes, filters):
+    expected = chart_filter(crimes, **filters)
+    selection = chart_filter(index, **filters)
+    pd.testing.assert_frame_equal(selection.astype(object), expected.astype(object)[list(selection.columns)])
+
+def test_cube_counts_filters(cube, crimes):
+    for filters in chart_filters(cube):
+        assert_same_counts(cube, crimes, filters)
+
+def test_row_index_filters(cube, crimes):
+    index = CrimeIndex(crimes)
+    for filters in chart_filters(cube):
+        pd.testing.assert_frame_equal(chart_filter(index, **filters), chart_filter(crimes, **filters))
+
+def test_store_counts_filters(tmp_path, cube, crimes):
+    save_crime_store(crimes, str(tmp_path))
+    columns, store_cube, index = load_crime_store(str(tmp_path))
+    df = columns.frame()
+    pd.testing.assert_frame_equal(df.astype(object), crimes.astype(object)[list(df.columns)])
+    for filters in chart_filters(cube):
+        assert_same_counts(store_cube, crimes, filters)
+        assert_same_rows(index, crimes, filters)
+
+def test_merged_cube_counts_filters(cube, crimes):
+    # the new records start on a later day, part way through a week
+    crimes = crimes.sort_values('DATE', kind = 'stable').reset_index(drop = True)
+    stored = len(crimes) - 1000
+    merged = merge_cubes(build_cube(crimes.iloc[:stored]), build_cube(crimes.iloc[stored:]))
+    assert merged is not None
+    assert merged.first_day == cube.first_day
+    np.testing.assert_array_equal(merged.cumulative, cube.cumulative)
+    for filters in chart_filters(cube):
+        assert_same_counts(merged, crimes, filters)
+
+def test_appended_store_counts_filters(tmp_path, cube, crimes):
+    crimes = crimes.sort_values('DATE', kind = 'stable').reset_index(drop = True)
+    stored = len(crimes) - 1000
+    save_crime_store(crimes.iloc[:stored].reset_index(drop = True), str(tmp_path))
+    for start in range(stored, len(crimes), 200):
+        previous = read_store_meta(str(tmp_path))
+        append_crime_store(crimes.iloc[start:start + 200].reset_index(drop = True), str(tmp_path))
+        # a worker that read the previous meta.json still loads the previous version
+        columns, store_cube, index = load_crime_store(str(tmp_path), meta = previous)
+        assert len(columns) == start and store_cube.total() == start
+    columns, store_cube, index = load_crime_store(str(tmp_path))
+    df = columns.frame()
+    assert all(len(segments) <= 3 for segments in index.postings.values())
+    pd.testing.assert_frame_equal(df.astype(object), crimes.astype(object)[list(df.columns)])
+    np.testing.assert_array_equal(store_cube.cumulative, cube.cumulative)
+    for filters in chart_filters(cube):
+        assert_same_counts(store_cube, crimes, filters)
+        assert_same_rows(index, crimes, filters)
+
+def test_streamed_store_counts_filters(tmp_path, crimes):
+    path = str(tmp_path / 'crime.csv')
+    write_crime_csv(crimes, path)
+    stream_crime_store(path, str(tmp_path / 'store'), partial_months = [], chunk_size = 3000)
+    columns, store_cube, index = load_crime_store(str(tmp_path / 'store'))
+    df = columns.frame()
+    pd.testing.assert_frame_equal(df.astype(object), crimes.astype(object)[list(df.columns)])
+    np.testing.assert_array_equal(store_cube.cumulative, build_cube(df).cumulative)
+    for filters in chart_filters(store_cube):
+        assert_same_counts(store_cube, crimes, filters)
+        assert_same_rows(index, crimes, filters)
+
+def test_store_columns_stay_memory_mapped(tmp_path, cube, crimes):
+    save_crime_store(crimes, str(tmp_path))
+    columns, store_cube, index = load_crime_store(str(tmp_path))
+    for filters in chart_filters(cube):
+        selection = chart_filter(index, **filters)
+        assert len(selection) == len(chart_filter(crimes, **filters))
+    for column in columns.columns:
+        assert isinstance(columns.arrays[column], np.memmap)
+    for column in ['YEAR', 'MONTH', 'HOUR', 'DATE']:
+        assert np.shares_memory(columns[column].to_numpy(), columns.arrays[column])